@@ -0,0 +1,63 @@
+"""
+Nombres de columnas aptos para BigQuery, compartidos por transform y load
+(solo biblioteca estándar: se importa sin las dependencias de GCP)
+"""
+
+import re
+from functools import lru_cache
+
+
+# ==========================================
+# LIMPIEZA DE NOMBRES DE CAMPOS
+# ==========================================
+# Tabla de reemplazos aplicada en una sola pasada con str.translate
+_BQ_COLUMN_TRANS = str.maketrans({
+    ".": "_", ";": "_", " ": "_", "-": "_", "/": "_",
+    "(": "", ")": "", '"': "", "'": "", ",": "_"
+})
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9_]")
+_MULTI_UNDERSCORE_RE = re.compile(r"_+")
+
+
+@lru_cache(maxsize=4096)
+def clean_bq_column(name: str) -> str:
+    """
+    Limpia nombres para BigQuery (sin puntos, espacios, etc.)
+    Memoizada: las claves se repiten en cada registro NDJSON
+    """
+    name = str(name).replace("\ufeff", "").strip().lower()  # BOM
+    
+    # Reemplazar caracteres especiales
+    name = name.translate(_BQ_COLUMN_TRANS)
+    
+    # Eliminar caracteres no alfanuméricos
+    name = _NON_ALNUM_RE.sub("", name)
+    name = _MULTI_UNDERSCORE_RE.sub("_", name).strip("_")
+    
+    # Si empieza con número, agregar prefijo
+    if name and name[0].isdigit():
+        name = f"col_{name}"
+    
+    return name or "unnamed"
+
+
+def dedupe_columns(columns: list) -> list:
+    """
+    Renombra columnas repetidas como col, col_1, col_2 (igual que pandas):
+    el sufijo sigue subiendo mientras el nombre ya esté en uso, así
+    ["a", "a", "a_1"] queda ["a", "a_1", "a_1_1"] y nunca se repite
+    """
+    seen = set()
+    counts = {}
+    result = []
+    for col in columns:
+        name = col
+        if name in seen:
+            n = counts.get(col, 0)
+            while name in seen:
+                n += 1
+                name = f"{col}_{n}"
+            counts[col] = n
+        seen.add(name)
+        result.append(name)
+    return result
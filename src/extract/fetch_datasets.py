@@ -1,7 +1,16 @@
+import argparse
+import asyncio
+import hashlib
 import requests
 import os
+import shutil
+import time
 import datetime
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from google.cloud import storage
 from src.config_loader import load_config
 
@@ -12,6 +21,12 @@ MODE = config["mode"]
 DATA_DIR = "data/raw"
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# Descargas simultáneas desde el bucket
+GCP_DOWNLOAD_WORKERS = 8
+
+# Caché local de respuestas de APIs (clave = URL)
+API_CACHE_DIR = "data/.api_cache"
+
 # ================================
 # Datasets estáticos (en GCP)
 # ================================
@@ -30,35 +45,92 @@ API_SOURCES = {
     "api_sismos_usgs": "https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson&orderby=time&limit=50"
 }
 
+# Segundos que una respuesta cacheada se considera vigente
+API_CACHE_TTL = {
+    "api_clima": 15 * 60,
+    "api_sismos_ec": 5 * 60,
+    "api_sismos_usgs": 5 * 60,
+}
+DEFAULT_CACHE_TTL = 15 * 60
+
+# Sesión HTTP compartida: reutiliza conexiones y reintenta errores transitorios
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=10,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+    ),
+))
+
 
 # ================================
 # FUNCIONES HELPERS
 # ================================
-def download_api(name, url, now):
+def cache_path(url):
+    return os.path.join(API_CACHE_DIR, hashlib.sha1(url.encode()).hexdigest())
+
+
+def is_cache_fresh(url, ttl):
+    """True si existe una respuesta cacheada para la URL que no ha expirado."""
+    try:
+        return time.time() - os.path.getmtime(cache_path(url)) <= ttl
+    except OSError:
+        return False
+
+
+def save_to_cache(url, path):
+    os.makedirs(API_CACHE_DIR, exist_ok=True)
+    tmp = cache_path(url) + ".tmp"
+    shutil.copyfile(path, tmp)
+    os.replace(tmp, cache_path(url))
+
+
+def download_api(name, url, now, use_cache=True):
     """Descarga datos desde APIs y los guarda localmente."""
     print(f"[INFO] Llamando API: {name}...")
 
-    r = requests.get(url, timeout=60)
-    r.raise_for_status()
-
     filename = f"{name}_{now}.json"
     path = os.path.join(DATA_DIR, filename)
 
-    with open(path, "wb") as f:
-        f.write(r.content)
+    if use_cache and is_cache_fresh(url, API_CACHE_TTL.get(name, DEFAULT_CACHE_TTL)):
+        shutil.copyfile(cache_path(url), path)
+        print(f"[CACHE] Respuesta reutilizada: {name}")
+    else:
+        # Se escribe por bloques: el cuerpo completo nunca está en memoria.
+        # Va a un .tmp que solo se renombra al llegar completo: un corte a
+        # mitad de respuesta no deja un JSON truncado en raw/
+        tmp = path + ".tmp"
+        try:
+            with SESSION.get(url, stream=True, timeout=(5, 60)) as r:
+                r.raise_for_status()
+                with open(tmp, "wb") as f:
+                    for chunk in r.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        save_to_cache(url, path)
 
     print(f"[OK] API guardada: {path}")
     return path
 
 
-def copy_from_bucket(blob_name, now):
-    """Copia archivos estáticos desde el bucket GCP a data/raw."""
-    bucket_name = config["gcp"]["bucket_raw"]
+@functools.cache
+def _storage_client():
+    """Cliente GCS único por proceso (las credenciales se leen una vez)"""
+    return storage.Client.from_service_account_json(config["gcp"]["credentials"])
+
 
+def copy_from_bucket(bucket, blob_name, now):
+    """Copia archivos estáticos desde el bucket GCP a data/raw."""
     print(f"[INFO] Copiando desde GCP: {blob_name}")
 
-    client = storage.Client.from_service_account_json(config["gcp"]["credentials"])
-    bucket = client.bucket(bucket_name)
     blob = bucket.blob(blob_name)
 
     ext = blob_name.split(".")[-1]
@@ -71,31 +143,57 @@ def copy_from_bucket(blob_name, now):
     return path
 
 
+def copy_static_files(now):
+    """Copia todos los estáticos en paralelo reutilizando un solo cliente GCP."""
+    bucket = _storage_client().bucket(config["gcp"]["bucket_raw"])
+
+    def copy_one(blob_name):
+        try:
+            return copy_from_bucket(bucket, blob_name, now)
+        except Exception as e:
+            print(f"[ERROR] No se pudo copiar {blob_name}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=GCP_DOWNLOAD_WORKERS) as ex:
+        paths = list(ex.map(copy_one, STATIC_FILES.values()))
+
+    return [p for p in paths if p is not None]
+
+
+async def download_api_async(name, url, now, use_cache=True):
+    """Ejecuta download_api en un hilo; devuelve None si la API falla."""
+    try:
+        return await asyncio.to_thread(download_api, name, url, now, use_cache)
+    except Exception as e:
+        print(f"[ERROR] API falló ({name}): {e}")
+        return None
+
+
+async def download_all_apis(now, use_cache=True):
+    """Lanza todas las APIs en paralelo; el tiempo total ≈ la API más lenta."""
+    async with asyncio.TaskGroup() as tg:
+        tasks = [
+            tg.create_task(download_api_async(name, url, now, use_cache))
+            for name, url in API_SOURCES.items()
+        ]
+    return [t.result() for t in tasks if t.result() is not None]
+
+
 # ================================
 # MAIN
 # ================================
-def main():
+def main(use_cache=True):
     now = datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S")
 
     downloaded_files = []
 
     # ---- ESTÁTICOS DESDE GCP ----
     print("\n========== ARCHIVOS ESTÁTICOS GCP ==========")
-    for name, blob_name in STATIC_FILES.items():
-        try:
-            path = copy_from_bucket(blob_name, now)
-            downloaded_files.append(path)
-        except Exception as e:
-            print(f"[ERROR] No se pudo copiar {blob_name}: {e}")
+    downloaded_files.extend(copy_static_files(now))
 
     # ---- APIs AUTOMÁTICAS ----
     print("\n========== APIS AUTOMÁTICAS ==========")
-    for name, url in API_SOURCES.items():
-        try:
-            path = download_api(name, url, now)
-            downloaded_files.append(path)
-        except Exception as e:
-            print(f"[ERROR] API falló ({name}): {e}")
+    downloaded_files.extend(asyncio.run(download_all_apis(now, use_cache)))
 
     # ---- RESUMEN ----
     print("\n========== RESUMEN DESCARGAS ==========")
@@ -106,4 +204,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Extracción de datasets estáticos y APIs")
+    parser.add_argument("--no-cache", action="store_true", help="Ignora la caché local y vuelve a llamar a las APIs")
+    args = parser.parse_args()
+    main(use_cache=not args.no_cache)
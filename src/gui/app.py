@@ -4,7 +4,8 @@ import glob
 
 st.title("Dashboard de Datos — Tesis Analítica")
 
-files = glob.glob("data/processed/*.parquet")
+# Los *_bqload.parquet son intermedios de la carga a BigQuery
+files = [f for f in glob.glob("data/processed/*.parquet") if not f.endswith("_bqload.parquet")]
 
 if not files:
     st.warning("No hay archivos procesados aún. Ejecuta el ETL primero.")
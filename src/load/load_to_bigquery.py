@@ -7,13 +7,35 @@ LOAD TO BIGQUERY V2 - PRODUCCIÓN
 """
 
 import os
-import json
+import csv
+import codecs
+import shutil
+import io
+import itertools
+import time
+import tempfile
+from collections import namedtuple
+import orjson
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.json as paj
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from functools import cache
 from google.cloud import bigquery, storage
+from google.cloud.storage import transfer_manager
+from google.api_core.retry import exponential_sleep_generator
+from google.auth.transport.requests import AuthorizedSession
+from google.oauth2 import service_account
+from requests.adapters import HTTPAdapter
 from src.config_loader import load_config
+from src.column_names import clean_bq_column, dedupe_columns
 import re
 
 config = load_config()
+MODE = config.get("mode", "local")
 PROJECT_ID = config["gcp"].get("project_id")
 DATASET_ID = (
     config["gcp"].get("dataset_id")
@@ -23,14 +45,43 @@ DATASET_ID = (
 )
 
 PROCESSED_DIR = "data/processed"
+SNIFF_BYTES = 8192  # muestra leída para detectar separador y encabezado
+NDJSON_SAMPLE_LINES = 128  # líneas revisadas para decidir si un NDJSON ya está limpio
+CSV_BLOCK_BYTES = 16 * 1024 * 1024  # bloque que cada hilo de PyArrow parsea a la vez
+WRITE_BUFFER_BYTES = 1 << 20        # escrituras agrupadas de ~1 MiB
+
+# Los intermedios _bqload van a memoria (/dev/shm) cuando caben; si no, a una
+# carpeta temporal en disco (BQ_WORK_DIR fija esa carpeta y desactiva tmpfs)
+WORK_ROOT = os.getenv("BQ_WORK_DIR")
+SHM_ROOT = "/dev/shm" if not WORK_ROOT and os.path.isdir("/dev/shm") else None
+SHM_SIZE_FACTOR = 3  # copia descargada + reescritura + margen, por archivo
+GCS_DOWNLOAD_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+LARGE_BLOB_BYTES = 8 * 1024 * 1024       # desde aquí se descarga por rangos
+DOWNLOAD_CHUNK_BYTES = 16 * 1024 * 1024
+BQ_LOAD_WORKERS = int(os.getenv("BQ_LOAD_WORKERS", "12"))
+JOB_TIMEOUT = 3600  # segundos máximos de espera por job de carga
+
+# En modo cloud los archivos limpios se suben a este prefijo del bucket
+# y BigQuery los ingiere directamente desde GCS (load_table_from_uri)
+PROCESSED_PREFIX = "processed/"
+STAGING_PREFIX = "staging/"
+HEAD_BYTES = 64 * 1024  # inicio del blob que se baja para inspeccionarlo
+
+# Archivo de processed/ que sigue en GCS (path es su URI gs://)
+RemoteFile = namedtuple("RemoteFile", ["name", "path", "size"])
+
+# Marca local de "el dataset ya existe": evita consultar la API en cada corrida
+DATASET_SENTINEL = os.path.join("data", f".dataset_{DATASET_ID}_ok")
+DATASET_SENTINEL_TTL = 24 * 60 * 60  # se vuelve a verificar una vez al día
 
 
 # ==========================================
 # REGLAS DE FILTRADO AUTOMÁTICO
 # ==========================================
-def should_skip_file(filename: str) -> tuple:
+def should_skip_file(filename: str, existing: set) -> tuple:
     """
     Determina si un archivo debe ser omitido
+    existing: nombres presentes en PROCESSED_DIR (se calcula una sola vez)
     Retorna: (skip: bool, reason: str)
     """
     # REGLA 1: Omitir _clean.json (corruptos)
@@ -45,16 +96,16 @@ def should_skip_file(filename: str) -> tuple:
     if filename.endswith("_cleanbin.json"):
         return True, "Duplicado (_cleanbin.json)"
     
-    # REGLA 4: Omitir MIES/MREMH _cleancsv (delimitadores rotos)
-    if ("mies_" in filename.lower() or "mremh_" in filename.lower()):
-        if "_cleancsv.csv" in filename:
+    # REGLAS 4 y 5: solo aplican a salidas _cleancsv (.csv o .parquet)
+    if "_cleancsv." in filename:
+        # REGLA 4: Omitir MIES/MREMH _cleancsv (delimitadores rotos)
+        lower = filename.lower()
+        if "mies_" in lower or "mremh_" in lower:
             return True, "CSV MIES/MREMH con delimitadores rotos"
-    
-    # REGLA 5: Omitir duplicados CSV generales
-    if "_cleancsv.csv" in filename:
-        base = filename.replace("_cleancsv.csv", "")
-        clean_version = f"{base}_clean.csv"
-        if os.path.exists(os.path.join(PROCESSED_DIR, clean_version)):
+        
+        # REGLA 5: Omitir duplicados CSV generales
+        base = filename.split("_cleancsv.", 1)[0]
+        if f"{base}_clean.csv" in existing:
             return True, "Duplicado de _clean.csv"
     
     return False, ""
@@ -63,67 +114,39 @@ def should_skip_file(filename: str) -> tuple:
 # ==========================================
 # VALIDACIÓN DE CSV
 # ==========================================
-def validate_csv(path: str) -> tuple:
-    """Valida estructura del CSV"""
+def sniff_csv(path: str) -> tuple:
+    """
+    Valida estructura del CSV y detecta el separador en una sola lectura
+    Retorna: (valid: bool, separator: str, reason: str)
+    """
     try:
-        with open(path, "r", encoding="utf-8-sig", errors="ignore") as f:
-            first_line = f.readline().strip()
+        # Una sola lectura acotada; los conteos se hacen sobre bytes
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            sample = os.read(fd, SNIFF_BYTES)
+        finally:
+            os.close(fd)
+        sample = sample.removeprefix(codecs.BOM_UTF8)
+        first_line = sample.split(b"\n", 1)[0].strip()
         
-        semicolon_count = first_line.count(";")
-        comma_count = first_line.count(",")
+        semicolon_count = first_line.count(b";")
+        comma_count = first_line.count(b",")
+        separator = ";" if sample.count(b";") > sample.count(b",") else ","
         
         # Si tiene muchos semicolons pero ninguna coma = malformado
         if semicolon_count > 10 and comma_count == 0:
-            return False, "CSV malformado (solo semicolons sin comas)"
+            return False, separator, "CSV malformado (solo semicolons sin comas)"
         
-        # Intentar parsear
-        separator = ";" if semicolon_count > comma_count else ","
-        df = pd.read_csv(
-            path, 
-            sep=separator, 
-            nrows=1, 
-            encoding="utf-8-sig", 
-            engine="python",
-            on_bad_lines='skip'
-        )
+        # Contar columnas del encabezado con el lector csv (respeta comillas)
+        header = next(csv.reader([first_line.decode("utf-8", errors="ignore")], delimiter=separator), [])
         
-        if len(df.columns) <= 1:
-            return False, "Solo 1 columna detectada (delimitador incorrecto)"
+        if len(header) <= 1:
+            return False, separator, "Solo 1 columna detectada (delimitador incorrecto)"
         
-        return True, ""
+        return True, separator, ""
     
     except Exception as e:
-        return False, f"Error al parsear: {str(e)[:60]}"
-
-
-# ==========================================
-# LIMPIEZA DE NOMBRES DE CAMPOS
-# ==========================================
-def clean_bq_column(name: str) -> str:
-    """Limpia nombres para BigQuery (sin puntos, espacios, etc.)"""
-    name = str(name)
-    name = name.replace("\ufeff", "")  # BOM
-    name = name.strip()
-    name = name.lower()
-    
-    # Reemplazar caracteres especiales
-    replacements = {
-        ".": "_", ";": "_", " ": "_", "-": "_", "/": "_",
-        "(": "", ")": "", '"': "", "'": "", ",": "_"
-    }
-    for old, new in replacements.items():
-        name = name.replace(old, new)
-    
-    # Eliminar caracteres no alfanuméricos
-    name = re.sub(r"[^a-z0-9_]", "", name)
-    name = re.sub(r"_+", "_", name)
-    name = name.strip("_")
-    
-    # Si empieza con número, agregar prefijo
-    if name and name[0].isdigit():
-        name = f"col_{name}"
-    
-    return name or "unnamed"
+        return False, ",", f"Error al parsear: {str(e)[:60]}"
 
 
 # ==========================================
@@ -131,72 +154,312 @@ def clean_bq_column(name: str) -> str:
 # ==========================================
 def flatten_dict(d: dict, parent_key: str = '', sep: str = '_') -> dict:
     """
-    Aplana diccionario anidado recursivamente
+    Aplana diccionario anidado (iterativo, con pila explícita)
     Ejemplo: {"geometry": {"coordinates": [1,2]}} 
           → {"geometry_coordinates": "[1,2]"}
     """
-    items = []
-    for k, v in d.items():
-        new_key = f"{parent_key}{sep}{k}" if parent_key else k
-        
-        if isinstance(v, dict):
-            # Recursión para objetos anidados
-            items.extend(flatten_dict(v, new_key, sep=sep).items())
-        elif isinstance(v, list):
-            # Listas → JSON string
-            items.append((new_key, json.dumps(v, ensure_ascii=False)))
+    out = {}
+    # Pila de iteradores: conserva el orden original de las claves
+    stack = [(parent_key, iter(d.items()))]
+    while stack:
+        prefix, items = stack[-1]
+        for k, v in items:
+            new_key = f"{prefix}{sep}{k}" if prefix else k
+            
+            if isinstance(v, dict):
+                # Objeto anidado: se procesa antes de seguir con este nivel
+                stack.append((new_key, iter(v.items())))
+                break
+            elif isinstance(v, list):
+                # Listas → JSON string
+                out[new_key] = orjson.dumps(v).decode()
+            else:
+                out[new_key] = v
         else:
-            items.append((new_key, v))
+            stack.pop()
     
-    return dict(items)
+    return out
+
+
+# ==========================================
+# NOMBRE DE TABLA DESTINO
+# ==========================================
+_TABLE_NAME_CLEANERS = [
+    re.compile(r"_\d{8,}"),  # Eliminar timestamps
+    re.compile(r"_(clean|expanded|releases|cleancsv|cleanbin).*"),
+    re.compile(r"\.\w+$"),  # Eliminar extensión
+]
+
+
+def table_name_for(filename: str) -> str:
+    """Deriva el nombre de tabla BigQuery a partir del nombre de archivo"""
+    base = filename
+    for pattern in _TABLE_NAME_CLEANERS:
+        base = pattern.sub("", base)
+    return clean_bq_column(base)
 
 
 # ==========================================
 # PROCESAMIENTO DE ARCHIVOS
 # ==========================================
-def process_csv(path: str) -> str:
-    """Limpia y normaliza CSV"""
-    print(f"    [→] Procesando CSV...")
-    
-    with open(path, "r", encoding="utf-8-sig", errors="ignore") as f:
-        sample = f.read(4096)
+def csv_header_is_clean(path: str) -> bool:
+    """
+    True si el encabezado ya cumple las reglas de BigQuery (sin BOM, nombres
+    limpios y sin repetidos): el archivo se puede cargar tal cual
+    """
+    with open(path, "rb") as f:
+        first_line = f.readline()
+    if first_line.startswith(codecs.BOM_UTF8):
+        return False
+    header = next(csv.reader([first_line.decode("utf-8", errors="ignore")]), [])
+    return header == dedupe_columns([clean_bq_column(c) for c in header])
 
-    separator = ";" if sample.count(";") > sample.count(",") else ","
-    
-    df = pd.read_csv(
-        path, 
-        sep=separator, 
-        encoding="utf-8-sig",
-        engine="python",
-        on_bad_lines='skip'
+
+def ndjson_is_clean(path: str, sample_lines: int = NDJSON_SAMPLE_LINES) -> bool:
+    """
+    True si las primeras líneas ya son objetos planos (sin dicts ni listas)
+    con nombres limpios: flatten_dict y clean_bq_column no cambiarían nada
+    """
+    with open(path, "rb") as f:
+        lines = [line for line in itertools.islice(f, sample_lines) if line.strip()]
+    if not lines:
+        return False
+    for i, line in enumerate(lines):
+        try:
+            obj = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            if i == len(lines) - 1 and not line.endswith(b"\n"):
+                break  # muestra parcial (solo el inicio del blob) cortada a mitad de línea
+            return False
+        if not isinstance(obj, dict):
+            return False
+        for k, v in obj.items():
+            if isinstance(v, (dict, list)) or k != clean_bq_column(k):
+                return False
+    return True
+
+
+def work_path(path: str, suffix: str, work_dir=None) -> str:
+    """Ruta del archivo intermedio <nombre>_bqload<suffix>: en work_dir o junto al original"""
+    name = os.path.splitext(os.path.basename(path))[0] + "_bqload" + suffix
+    return os.path.join(work_dir or os.path.dirname(path), name)
+
+
+def open_output(cleaned_path: str, staging_bucket=None) -> tuple:
+    """
+    Destino del archivo limpio: en modo cloud un blob de staging/ en GCS
+    (sin copia local), si no un archivo local
+    Retorna: (ruta o URI gs://, archivo abierto en modo binario)
+    """
+    if staging_bucket is not None:
+        blob = staging_bucket.blob(STAGING_PREFIX + os.path.basename(cleaned_path))
+        return f"gs://{staging_bucket.name}/{blob.name}", blob.open("wb")
+    return cleaned_path, open(cleaned_path, "wb", buffering=WRITE_BUFFER_BYTES)
+
+
+def normalize_arrow_table(table: pa.Table) -> pa.Table:
+    """
+    Deja una tabla Arrow lista para BigQuery: aplana structs (a.b → a_b),
+    serializa listas como JSON (igual que flatten_dict) y limpia nombres
+    """
+    while any(pa.types.is_struct(field.type) for field in table.schema):
+        table = table.flatten()
+
+    for i, field in enumerate(table.schema):
+        if pa.types.is_list(field.type) or pa.types.is_large_list(field.type):
+            values = [None if v is None else orjson.dumps(v).decode()
+                      for v in table.column(i).to_pylist()]
+            table = table.set_column(i, field.name, pa.array(values, pa.string()))
+        elif pa.types.is_null(field.type):
+            # Columna siempre nula: BigQuery no acepta el tipo NULL de Parquet
+            table = table.set_column(i, field.name, table.column(i).cast(pa.string()))
+
+    return table.rename_columns(
+        dedupe_columns([clean_bq_column(c) for c in table.column_names])
     )
 
-    # Limpiar nombres de columnas
-    df.columns = [clean_bq_column(c) for c in df.columns]
-    
-    cleaned_path = path.replace(".csv", "_bqload.csv")
-    df.to_csv(cleaned_path, index=False, encoding="utf-8", sep=",")
-    
-    print(f"    [✓] {len(df)} filas, {len(df.columns)} columnas")
-    print(f"        Columnas: {', '.join(df.columns[:5])}...")
+
+def write_parquet(table: pa.Table, cleaned_path: str, staging_bucket=None) -> str:
+    """Escribe la tabla como Parquet (Snappy) en el destino de open_output"""
+    destination, out = open_output(cleaned_path, staging_bucket)
+    with out as fw:
+        pq.write_table(table, fw, compression="snappy")
+    return destination
+
+
+def csv_to_parquet(path: str, separator: str, staging_bucket=None, work_dir=None) -> str:
+    """
+    Lee el CSV con el lector multihilo de PyArrow y lo escribe como Parquet
+    (tipos ya resueltos: BigQuery no tiene que inferirlos); si hay filas con
+    columnas de menos, lo lee pandas para conservarlas con nulos
+    """
+    bad_rows = []
+    short_rows = []
+
+    def skip_row(row):
+        # Igual que on_bad_lines='skip' de pandas: solo se descarta la fila con
+        # columnas de más; la que tiene de menos corta la lectura (ver abajo)
+        if row.actual_columns > row.expected_columns:
+            bad_rows.append(row.number)
+            return "skip"
+        short_rows.append(row.number)
+        return "error"
+
+    try:
+        table = pacsv.read_csv(
+            path,
+            read_options=pacsv.ReadOptions(block_size=CSV_BLOCK_BYTES, use_threads=True),
+            parse_options=pacsv.ParseOptions(delimiter=separator, invalid_row_handler=skip_row),
+            convert_options=pacsv.ConvertOptions(strings_can_be_null=True),
+        )
+    except pa.ArrowInvalid:
+        if not short_rows:
+            raise
+        # Filas con columnas de menos: pandas las completa con nulos en vez de
+        # perderlas (PyArrow solo sabe descartarlas)
+        print(f"        [!] Filas con columnas de menos: se leen con pandas")
+        bad_rows.clear()  # pandas descarta las de más sin contarlas
+        df = pd.read_csv(path, sep=separator, encoding="utf-8", on_bad_lines="skip")
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    # PyArrow no falla con UTF-8 inválido: tipa la columna como binary, que
+    # llegaría a BigQuery como BYTES; se trata como archivo no legible
+    binary = [f.name for f in table.schema
+              if pa.types.is_binary(f.type) or pa.types.is_large_binary(f.type)]
+    if binary:
+        raise pa.ArrowInvalid(f"UTF-8 inválido en columnas: {', '.join(binary[:5])}")
+    table = normalize_arrow_table(table)
+    destination = write_parquet(table, work_path(path, ".parquet", work_dir), staging_bucket)
+
+    print(f"    [✓] {table.num_rows} filas, {table.num_columns} columnas (Parquet)")
+    print(f"        Columnas: {', '.join(table.column_names[:5])}...")
+    if bad_rows:
+        print(f"        [!] {len(bad_rows)} filas irregulares ignoradas")
+    return destination
+
+
+def process_csv(path: str, separator: str, staging_bucket=None, work_dir=None) -> tuple:
+    """
+    Limpia el CSV: primero vía PyArrow → Parquet; si PyArrow no puede
+    leerlo (p. ej. UTF-8 inválido), reescribe el CSV en streaming
+    El separador viene de sniff_csv
+    Retorna: (ruta o URI gs:// del archivo limpio, formato de carga)
+    """
+    print(f"    [→] Procesando CSV...")
+
+    try:
+        return csv_to_parquet(path, separator, staging_bucket, work_dir), "parquet"
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError, UnicodeDecodeError) as e:
+        print(f"        [!] PyArrow no pudo leerlo ({str(e)[:80]}); se reescribe en streaming")
+
+    return rewrite_csv(path, separator, staging_bucket, work_dir), "csv"
+
+
+def rewrite_csv(path: str, separator: str, staging_bucket=None, work_dir=None) -> str:
+    """
+    Limpia el encabezado y copia el resto del CSV en streaming
+    (sin cargar el archivo completo en memoria); en modo cloud se escribe
+    directo al blob de staging/
+    """
+    destination, out = open_output(work_path(path, ".csv", work_dir), staging_bucket)
+    rows = None
+
+    if separator == ",":
+        # Solo cambia la primera línea: el cuerpo se copia byte a byte
+        with open(path, "rb") as src, out as dst:
+            first_line = src.readline().decode("utf-8-sig", errors="ignore")
+            header = next(csv.reader([first_line]), [])
+            columns = dedupe_columns([clean_bq_column(c) for c in header])
+            dst.write((",".join(columns) + "\n").encode("utf-8"))
+            shutil.copyfileobj(src, dst, 1 << 20)
+    else:
+        # Cambiar el delimitador exige re-escribir cada fila respetando comillas
+        with open(path, "r", encoding="utf-8-sig", errors="ignore", newline="") as src, \
+             io.TextIOWrapper(out, encoding="utf-8", newline="") as dst:
+            reader = csv.reader(src, delimiter=separator)
+            writer = csv.writer(dst, delimiter=",")
+
+            header = next(reader, [])
+            columns = dedupe_columns([clean_bq_column(c) for c in header])
+            writer.writerow(columns)
+
+            rows = 0
+            for row in reader:
+                # Igual que on_bad_lines='skip': se descartan filas vacías o con columnas de más;
+                # las que tienen de menos se completan con vacíos, como los NaN de pandas
+                if not row or len(row) > len(columns):
+                    continue
+                if len(row) < len(columns):
+                    row += [""] * (len(columns) - len(row))
+                writer.writerow(row)
+                rows += 1
+
+    if rows is not None:
+        print(f"    [✓] {rows} filas, {len(columns)} columnas")
+    else:
+        print(f"    [✓] {len(columns)} columnas")
+    print(f"        Columnas: {', '.join(columns[:5])}...")
     
-    return cleaned_path
+    return destination
+
+
+def parquet_columns_are_clean(path: str) -> bool:
+    """
+    Revisa solo el esquema (footer) del Parquet; si es gs:// se lee con
+    rangos desde GCS sin bajar el archivo completo
+    """
+    if path.startswith("gs://"):
+        with blob_for_uri(path).open("rb") as f:
+            schema = pq.read_schema(f)
+    else:
+        schema = pq.read_schema(path)
+    names = schema.names
+    flat = not any(pa.types.is_nested(field.type) for field in schema)
+    return flat and names == dedupe_columns([clean_bq_column(c) for c in names])
+
+
+def process_parquet(path: str, staging_bucket=None, work_dir=None) -> str:
+    """Parquet con nombres o tipos no aptos para BigQuery: se normaliza y reescribe"""
+    print(f"    [→] Procesando Parquet...")
+    table = normalize_arrow_table(pq.read_table(path))
+    destination = write_parquet(table, work_path(path, ".parquet", work_dir), staging_bucket)
+    print(f"    [✓] {table.num_rows} filas, {table.num_columns} columnas")
+    return destination
 
 
-def process_ndjson(path: str) -> str:
+def ndjson_to_parquet(path: str, staging_bucket=None, work_dir=None) -> str:
     """
-    Aplana NDJSON línea por línea
+    Lee el NDJSON completo con el parser C++ de PyArrow, aplana y limpia
+    nombres, y lo escribe como Parquet (esquema explícito para BigQuery)
+    """
+    table = paj.read_json(path, read_options=paj.ReadOptions(block_size=32 << 20))
+    table = normalize_arrow_table(table)
+    destination = write_parquet(table, work_path(path, ".parquet", work_dir), staging_bucket)
+
+    print(f"    [✓] {table.num_rows} registros procesados (Parquet)")
+    return destination
+
+
+def process_ndjson(path: str, staging_bucket=None, work_dir=None) -> tuple:
+    """
+    Aplana NDJSON: primero vía PyArrow → Parquet; si el archivo tiene líneas
+    inválidas o tipos mezclados, línea por línea → NDJSON
     Convierte: "geometry.coordinates" → "geometry_coordinates"
+    Retorna: (ruta o URI gs:// del archivo limpio, formato de carga)
     """
     print(f"    [→] Procesando NDJSON...")
-    
-    cleaned_path = path.replace(".ndjson", "_bqload.ndjson")
+
+    try:
+        return ndjson_to_parquet(path, staging_bucket, work_dir), "parquet"
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+        print(f"        [!] PyArrow no pudo leerlo ({str(e)[:80]}); se procesa línea por línea")
+
+    destination, out = open_output(work_path(path, ".ndjson", work_dir), staging_bucket)
     
     count = 0
     skipped = 0
+    buf = bytearray()  # se vacía al disco/GCS por bloques de WRITE_BUFFER_BYTES
     
-    with open(path, "r", encoding="utf-8", errors="ignore") as fr, \
-         open(cleaned_path, "w", encoding="utf-8") as fw:
+    with open(path, "r", encoding="utf-8", errors="ignore") as fr, out as fw:
         
         for line_num, line in enumerate(fr, 1):
             line = line.strip()
@@ -204,7 +467,7 @@ def process_ndjson(path: str) -> str:
                 continue
 
             try:
-                obj = json.loads(line)
+                obj = orjson.loads(line)
                 
                 # PASO 1: Aplanar
                 flattened = flatten_dict(obj)
@@ -212,67 +475,195 @@ def process_ndjson(path: str) -> str:
                 # PASO 2: Limpiar nombres
                 cleaned = {clean_bq_column(k): v for k, v in flattened.items()}
                 
-                fw.write(json.dumps(cleaned, ensure_ascii=False) + "\n")
+                buf += orjson.dumps(cleaned)
+                buf += b"\n"
                 count += 1
+                if len(buf) >= WRITE_BUFFER_BYTES:
+                    fw.write(buf)
+                    buf.clear()
                 
-            except json.JSONDecodeError as e:
+            except orjson.JSONDecodeError:
                 skipped += 1
                 if skipped <= 3:  # Solo mostrar primeros 3 errores
                     print(f"        [!] Línea {line_num} ignorada: JSON inválido")
+
+        fw.write(buf)
     
     print(f"    [✓] {count} registros procesados")
     if skipped > 0:
         print(f"        [!] {skipped} líneas ignoradas (JSON inválido)")
     
-    return cleaned_path
+    return destination, "ndjson"
+
+
+# ==========================================
+# CLIENTES GCP (uno por proceso, creados al primer uso)
+# ==========================================
+@cache
+def _bq_client():
+    return bigquery.Client.from_service_account_json(config["gcp"]["credentials"])
+
+
+@cache
+def _storage_client():
+    """
+    Cliente de GCS con un pool de conexiones del tamaño de los hilos
+    (el de requests por defecto es 10 y serializa las descargas paralelas)
+    """
+    credentials = service_account.Credentials.from_service_account_file(
+        config["gcp"]["credentials"], scopes=storage.Client.SCOPE
+    )
+    pool_size = max(GCS_DOWNLOAD_WORKERS, BQ_LOAD_WORKERS)
+    session = AuthorizedSession(credentials)
+    session.mount("https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+    return storage.Client(project=credentials.project_id, credentials=credentials, _http=session)
+
+
+def _staging_bucket():
+    """Bucket donde se escriben los archivos limpios en modo cloud; None en local"""
+    if MODE != "cloud":
+        return None
+    return _storage_client().bucket(config["gcp"]["bucket_processed"])
+
+
+def _reset_clients():
+    """Initializer del pool: un proceso hijo no debe reusar las conexiones heredadas del padre"""
+    _bq_client.cache_clear()
+    _storage_client.cache_clear()
 
 
 # ==========================================
 # BIGQUERY
 # ==========================================
 def ensure_dataset(client):
-    dataset_ref = bigquery.Dataset(f"{PROJECT_ID}.{DATASET_ID}")
-    try:
-        client.get_dataset(dataset_ref)
-        print(f"[✓] Dataset existente: {DATASET_ID}\n")
-    except Exception:
-        print(f"[+] Creando dataset: {DATASET_ID}")
-        client.create_dataset(dataset_ref)
-        print(f"[✓] Dataset creado\n")
+    if (os.path.exists(DATASET_SENTINEL)
+            and time.time() - os.path.getmtime(DATASET_SENTINEL) < DATASET_SENTINEL_TTL):
+        print(f"[✓] Dataset existente: {DATASET_ID} (verificado recientemente)\n")
+        return
+
+    # Una sola llamada: crea el dataset o no hace nada si ya existe;
+    # errores reales (credenciales, permisos) se propagan en vez de ocultarse
+    client.create_dataset(bigquery.Dataset(f"{PROJECT_ID}.{DATASET_ID}"), exists_ok=True)
+    print(f"[✓] Dataset listo: {DATASET_ID}\n")
 
+    os.makedirs(os.path.dirname(DATASET_SENTINEL), exist_ok=True)
+    with open(DATASET_SENTINEL, "w"):
+        pass
 
-def load_csv_to_bq(client, table_id, file_path):
-    """Carga CSV a BigQuery"""
-    job_config = bigquery.LoadJobConfig(
+
+def csv_job_config(write_disposition="WRITE_TRUNCATE"):
+    return bigquery.LoadJobConfig(
         autodetect=True,
-        write_disposition="WRITE_TRUNCATE",  # CAMBIO: Reemplaza datos en vez de append
+        write_disposition=write_disposition,  # TRUNCATE en el primer archivo de cada tabla, APPEND en el resto
         source_format=bigquery.SourceFormat.CSV,
         skip_leading_rows=1,
         encoding="UTF-8",
         allow_quoted_newlines=True,
+        allow_jagged_rows=True,  # filas con columnas de menos: nulos, como en pandas
     )
 
-    with open(file_path, "rb") as f:
-        job = client.load_table_from_file(f, destination=table_id, job_config=job_config)
-
-    job.result()
-    print(f"    [✓] Cargado a BigQuery")
-
 
-def load_ndjson_to_bq(client, table_id, file_path):
-    """Carga NDJSON a BigQuery"""
-    job_config = bigquery.LoadJobConfig(
+def ndjson_job_config(write_disposition="WRITE_TRUNCATE"):
+    return bigquery.LoadJobConfig(
         autodetect=True,
-        write_disposition="WRITE_TRUNCATE",  # CAMBIO: Reemplaza datos en vez de append
+        write_disposition=write_disposition,  # TRUNCATE en el primer archivo de cada tabla, APPEND en el resto
         source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
         encoding="UTF-8",
     )
 
+
+def parquet_job_config(write_disposition="WRITE_TRUNCATE"):
+    # El esquema viaja en el archivo: no hace falta autodetect
+    return bigquery.LoadJobConfig(
+        write_disposition=write_disposition,  # TRUNCATE en el primer archivo de cada tabla, APPEND en el resto
+        source_format=bigquery.SourceFormat.PARQUET,
+    )
+
+
+JOB_CONFIGS = {
+    "csv": csv_job_config,
+    "ndjson": ndjson_job_config,
+    "parquet": parquet_job_config,
+}
+
+
+def load_csv_to_bq(client, table_id, file_path, write_disposition="WRITE_TRUNCATE"):
+    """Sube CSV a BigQuery; devuelve el job sin esperar a que termine"""
+    with open(file_path, "rb") as f:
+        return client.load_table_from_file(
+            f, destination=table_id, job_config=csv_job_config(write_disposition)
+        )
+
+
+def load_ndjson_to_bq(client, table_id, file_path, write_disposition="WRITE_TRUNCATE"):
+    """Sube NDJSON a BigQuery; devuelve el job sin esperar a que termine"""
     with open(file_path, "rb") as f:
-        job = client.load_table_from_file(f, destination=table_id, job_config=job_config)
+        return client.load_table_from_file(
+            f, destination=table_id, job_config=ndjson_job_config(write_disposition)
+        )
+
+
+def load_parquet_to_bq(client, table_id, file_path, write_disposition="WRITE_TRUNCATE"):
+    """Sube Parquet a BigQuery; devuelve el job sin esperar a que termine"""
+    with open(file_path, "rb") as f:
+        return client.load_table_from_file(
+            f, destination=table_id, job_config=parquet_job_config(write_disposition)
+        )
 
-    job.result()
-    print(f"    [✓] Cargado a BigQuery")
+
+def load_uri_to_bq(client, table_id, uri, kind, write_disposition="WRITE_TRUNCATE"):
+    """
+    BigQuery lee directamente desde GCS: los datos no pasan por esta máquina
+    uri: un URI o una lista de URIs del mismo formato (se cargan en un solo job)
+    """
+    return client.load_table_from_uri(
+        uri, destination=table_id, job_config=JOB_CONFIGS[kind](write_disposition)
+    )
+
+
+def load_file_to_bq(client, table_id, path, kind=None, write_disposition="WRITE_TRUNCATE"):
+    """
+    Punto único de carga: elige el loader según el formato (por defecto
+    deducido de la extensión) y si el origen es local o en GCS
+    path: ruta local, URI gs:// o lista de URIs del mismo formato
+    Devuelve el job sin esperar a que termine
+    """
+    if kind is None:
+        kind = SOURCE_KINDS.get(os.path.splitext(path)[1])
+        if kind is None:
+            raise ValueError(f"Formato no soportado para BigQuery: {path}")
+    if isinstance(path, list) or path.startswith("gs://"):
+        # En GCS (processed/ o staging/): BigQuery lo lee directamente
+        return load_uri_to_bq(client, table_id, path, kind, write_disposition)
+    return LOADERS[kind](client, table_id, path, write_disposition)
+
+
+def list_bucket_sources(bucket) -> list:
+    """
+    Archivos de processed/ en GCS sin descargarlos: prepare_file baja el
+    inicio para inspeccionarlo y el archivo completo solo si hay que reescribirlo
+    """
+    print(f"[→] Listando gs://{bucket.name}/{PROCESSED_PREFIX} (sin descargar)...\n")
+    return [
+        RemoteFile(os.path.basename(b.name), f"gs://{bucket.name}/{b.name}", b.size or 0)
+        for b in bucket.list_blobs(prefix=PROCESSED_PREFIX)
+        if not b.name.endswith("/")
+    ]
+
+
+def blob_for_uri(uri: str):
+    bucket_name, blob_name = uri[len("gs://"):].split("/", 1)
+    return _storage_client().bucket(bucket_name).blob(blob_name)
+
+
+def fetch_blob(uri: str, dest: str, head_bytes=None) -> str:
+    """Descarga un objeto gs:// (o solo sus primeros head_bytes) a dest"""
+    blob = blob_for_uri(uri)
+    if head_bytes:
+        blob.download_to_filename(dest, start=0, end=head_bytes - 1)
+    else:
+        blob.download_to_filename(dest)
+    return dest
 
 
 def download_files_if_needed():
@@ -282,95 +673,407 @@ def download_files_if_needed():
         return
 
     os.makedirs(PROCESSED_DIR, exist_ok=True)
-    client = storage.Client.from_service_account_json(config["gcp"]["credentials"])
-    bucket = client.bucket(config["gcp"]["bucket_processed"])
+    bucket = _storage_client().bucket(config["gcp"]["bucket_processed"])
+
+    print(f"[→] Descargando desde gs://{bucket.name}/{PROCESSED_PREFIX}...\n")
 
-    print(f"[→] Descargando desde gs://{bucket.name}/processed/...\n")
+    blobs = [b for b in bucket.list_blobs(prefix=PROCESSED_PREFIX) if not b.name.endswith("/")]
+    small = [b for b in blobs if (b.size or 0) <= LARGE_BLOB_BYTES]
+    large = [b for b in blobs if (b.size or 0) > LARGE_BLOB_BYTES]
+
+    # Archivos chicos: muchos a la vez, una conexión cada uno
+    results = transfer_manager.download_many(
+        [(b, os.path.join(PROCESSED_DIR, os.path.basename(b.name))) for b in small],
+        max_workers=GCS_DOWNLOAD_WORKERS,
+        worker_type=transfer_manager.THREAD,
+    )
 
-    for blob in bucket.list_blobs(prefix="processed/"):
-        if blob.name.endswith("/"):
+    # Archivos grandes: uno a la vez, en rangos paralelos
+    for blob in large:
+        try:
+            transfer_manager.download_chunks_concurrently(
+                blob,
+                os.path.join(PROCESSED_DIR, os.path.basename(blob.name)),
+                chunk_size=DOWNLOAD_CHUNK_BYTES,
+                max_workers=GCS_DOWNLOAD_WORKERS,
+                worker_type=transfer_manager.THREAD,
+            )
+            results.append(None)
+        except Exception as e:
+            results.append(e)
+
+    # Solo se detallan los errores; los éxitos se resumen en una línea
+    errors = [(blob, result) for blob, result in zip(small + large, results)
+              if isinstance(result, Exception)]
+    for blob, error in errors:
+        print(f"    [✗] {os.path.basename(blob.name)}: {str(error)[:100]}")
+    print(f"    [✓] {len(blobs) - len(errors)}/{len(blobs)} archivos descargados")
+
+
+# ==========================================
+# PLANIFICACIÓN (sin leer contenido)
+# ==========================================
+SOURCE_KINDS = {
+    ".csv": "csv",
+    ".ndjson": "ndjson",
+    ".parquet": "parquet",
+}
+
+
+def plan_files(entries, existing: set, work_dir=None,
+               dataset_id=DATASET_ID, source_kinds=SOURCE_KINDS, shm_dir=None) -> list:
+    """
+    Decide qué hacer con cada archivo antes del trabajo pesado:
+    filtrado, tabla destino y formato. Retorna una lista de dicts
+    con status "planned" o "skipped"
+    work_dir: carpeta donde se escriben los intermedios _bqload
+    shm_dir: carpeta en tmpfs para los archivos que caben (ver pick_work_dir)
+    dataset_id, source_kinds: dataset destino y extensiones aceptadas
+    (src/warehouse carga en el dataset de analytics y acepta también .json)
+    """
+    plan = []
+    for entry in entries:
+        item = {"filename": entry.name, "path": entry.path, "status": "skipped",
+                "kind": None, "table_id": None, "processed_path": None,
+                "size": entry.size if isinstance(entry, RemoteFile) else entry.stat().st_size,
+                "work_dir": work_dir, "shm_dir": shm_dir, "error": None, "log": ""}
+        plan.append(item)
+
+        # ========== FILTRADO AUTOMÁTICO ==========
+        should_skip, skip_reason = should_skip_file(entry.name, existing)
+        if should_skip:
+            item["log"] = f"[⊘] OMITIDO: {skip_reason}\n\n"
             continue
-        dest = os.path.join(PROCESSED_DIR, os.path.basename(blob.name))
-        blob.download_to_filename(dest)
-        print(f"    [✓] {os.path.basename(blob.name)}")
+
+        table_name = table_name_for(entry.name)
+        item["table_id"] = f"{PROJECT_ID}.{dataset_id}.{table_name}"
+        item["log"] = f"[→] Tabla destino: {table_name}\n"
+
+        kind = source_kinds.get(os.path.splitext(entry.name)[1])
+        if kind is None:
+            item["log"] += "[⊘] Formato no soportado\n\n"
+            continue
+
+        item.update(status="planned", kind=kind)
+
+    return plan
+
+
+# ==========================================
+# PREPROCESAMIENTO (en procesos paralelos)
+# ==========================================
+def remove_files(paths) -> None:
+    """Borra temporales ya usados; los que falten o fallen no detienen la corrida"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def make_work_dirs() -> tuple:
+    """Carpetas de intermedios de la corrida: (disco, tmpfs o None)"""
+    work_dir = tempfile.mkdtemp(prefix="bqload_", dir=WORK_ROOT)
+    shm_dir = tempfile.mkdtemp(prefix="bqload_", dir=SHM_ROOT) if SHM_ROOT else None
+    return work_dir, shm_dir
+
+
+def pick_work_dir(item: dict) -> str:
+    """
+    tmpfs solo si el archivo cabe con holgura en la parte del espacio libre
+    que le toca a cada proceso (todos escriben a la vez); si no, el disco
+    """
+    if item["shm_dir"]:
+        try:
+            share = shutil.disk_usage(item["shm_dir"]).free // (os.cpu_count() or 1)
+        except OSError:
+            return item["work_dir"]
+        if item["size"] * SHM_SIZE_FACTOR <= share:
+            return item["shm_dir"]
+    return item["work_dir"]
+
+
+def is_staging_uri(path: str) -> bool:
+    return path.startswith("gs://") and path[len("gs://"):].split("/", 1)[-1].startswith(STAGING_PREFIX)
+
+
+def remove_staging(uris) -> None:
+    """Borra blobs de staging/ ya cargados; los que fallen no detienen la corrida"""
+    for uri in uris:
+        try:
+            blob_for_uri(uri).delete()
+        except Exception:
+            pass
+
+
+def as_is_source(item: dict) -> str:
+    """
+    Origen para cargar un archivo sin reescribirlo: si vino del listado del
+    bucket, su URI gs:// (BigQuery lo lee directo desde GCS). En modo cloud un
+    archivo local se sube antes a staging/, como los reescritos, porque nada
+    garantiza que también esté en processed/; en local, la ruta tal cual
+    """
+    if item["path"].startswith("gs://") or MODE != "cloud":
+        return item["path"]
+    print(f"    [↑] Subiendo a {STAGING_PREFIX}...")
+    blob = _staging_bucket().blob(STAGING_PREFIX + item["filename"])
+    blob.upload_from_filename(item["path"])
+    return f"gs://{blob.bucket.name}/{blob.name}"
+
+
+def prepare_file(item: dict) -> dict:
+    """
+    Valida y limpia un archivo planificado sin tocar BigQuery
+    Se ejecuta en un proceso aparte: la salida se captura y se agrega
+    a "log" para imprimirla en orden desde el proceso principal
+    """
+    log = io.StringIO()
+    scratch = []  # descargas temporales de este archivo, se borran al terminar
+    item["work_dir"] = pick_work_dir(item)
+
+    with redirect_stdout(log):
+        try:
+            # Archivo aún en GCS: se inspecciona solo su inicio
+            # (en Parquet basta el esquema, que se lee por rangos)
+            remote = item["path"].startswith("gs://")
+            probe = item["path"]
+            if remote and item["kind"] != "parquet":
+                head_path = os.path.join(item["work_dir"], item["filename"] + ".head")
+                scratch.append(head_path)
+                probe = fetch_blob(item["path"], head_path, HEAD_BYTES)
+
+            def local_copy():
+                # Solo se descarga completo cuando hay que reescribirlo
+                if not remote:
+                    return item["path"]
+                print(f"    [↓] Descargando {item['filename']}...")
+                copy_path = os.path.join(item["work_dir"], item["filename"])
+                scratch.append(copy_path)
+                return fetch_blob(item["path"], copy_path)
+
+            # ========== CSV ==========
+            if item["kind"] == "csv":
+                valid, separator, reason = sniff_csv(probe)
+                if not valid:
+                    print(f"[✗] CSV inválido: {reason}\n")
+                    item["status"] = "skipped"
+                elif separator == "," and csv_header_is_clean(probe):
+                    print(f"    [✓] Encabezado ya limpio: se carga sin reescribir")
+                    item.update(status="ready", processed_path=as_is_source(item))
+                else:
+                    processed_path, kind = process_csv(local_copy(), separator, _staging_bucket(), item["work_dir"])
+                    item.update(status="ready", processed_path=processed_path, kind=kind)
+
+            # ========== PARQUET ==========
+            elif item["kind"] == "parquet":
+                if parquet_columns_are_clean(item["path"]):
+                    print(f"    [✓] Parquet con nombres limpios: se carga sin reescribir")
+                    item.update(status="ready", processed_path=as_is_source(item))
+                else:
+                    processed_path = process_parquet(local_copy(), _staging_bucket(), item["work_dir"])
+                    item.update(status="ready", processed_path=processed_path)
+
+            # ========== NDJSON ==========
+            elif item["kind"] == "ndjson":
+                if ndjson_is_clean(probe):
+                    print(f"    [✓] NDJSON ya plano y con nombres limpios: se carga sin reescribir")
+                    item.update(status="ready", processed_path=as_is_source(item))
+                else:
+                    processed_path, kind = process_ndjson(local_copy(), _staging_bucket(), item["work_dir"])
+                    item.update(status="ready", processed_path=processed_path, kind=kind)
+
+        except Exception as e:
+            item.update(status="failed", error=str(e)[:200])
+        finally:
+            remove_files(scratch)
+
+    item["log"] += log.getvalue()
+    return item
 
 
 # ==========================================
 # MAIN
 # ==========================================
+LOADERS = {
+    "csv": load_csv_to_bq,
+    "ndjson": load_ndjson_to_bq,
+    "parquet": load_parquet_to_bq,
+}
+
+
+def wait_for_job(job, timeout=JOB_TIMEOUT):
+    """
+    Espera un job con sondeo de intervalo creciente (1s, 2s, 4s... hasta 30s):
+    los jobs cortos se detectan rápido y los largos no saturan la API
+    Lanza la excepción del job si falló
+    """
+    deadline = time.monotonic() + timeout
+    for delay in exponential_sleep_generator(initial=1.0, maximum=30.0):
+        if job.done():
+            break
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(f"Job {job.job_id} sin terminar tras {timeout}s")
+        time.sleep(delay)
+    return job.result()
+
+
+def item_report(idx: int, total: int, item: dict) -> str:
+    """Encabezado y salida acumulada de un archivo, listos para imprimir"""
+    report = f"\n{'='*75}\n[{idx}/{total}] {item['filename']}\n{'='*75}\n{item['log']}"
+    if item["status"] == "failed":
+        report += f"[✗] ERROR: {item['error']}\n\n"
+    return report
+
+
+def load_batches(items: list) -> list:
+    """
+    Agrupa los archivos listos de una tabla en cargas:
+    los que están en GCS van en un solo job por formato (lista de URIs),
+    los locales en un job cada uno (load_table_from_file sube un archivo)
+    Retorna: [(kind, origen, [items])], origen = URI, lista de URIs o ruta local
+    """
+    batches = []
+    by_kind = {}
+    for item in items:
+        if item["processed_path"].startswith("gs://"):
+            if item["kind"] not in by_kind:
+                by_kind[item["kind"]] = (item["kind"], [], [])
+                batches.append(by_kind[item["kind"]])
+            by_kind[item["kind"]][1].append(item["processed_path"])
+            by_kind[item["kind"]][2].append(item)
+        else:
+            batches.append((item["kind"], item["processed_path"], [item]))
+    return batches
+
+
+def load_table_group(client, pending, total) -> tuple:
+    """
+    Carga todos los archivos de una misma tabla:
+    la primera carga con TRUNCATE y el resto con APPEND
+    pending: [(idx, future de prepare_file)]; mientras este hilo espera,
+    los procesos siguen limpiando y los demás hilos cargan otras tablas
+    Se ejecuta en un hilo; la salida se acumula en un buffer
+    Retorna: (cargados, omitidos, fallidos, log)
+    """
+    log = io.StringIO()
+    loaded = 0
+    skipped = 0
+    failed = 0
+    truncated = False
+
+    ready = []
+    for idx, future in pending:
+        item = future.result()
+        log.write(item_report(idx, total, item))
+
+        if item["status"] == "skipped":
+            skipped += 1
+        elif item["status"] == "failed":
+            failed += 1
+        else:
+            ready.append(item)
+
+    # Un job por formato en GCS en vez de uno por archivo: se paga una sola
+    # vez la planificación del job del lado de BigQuery
+    for kind, source, items in load_batches(ready):
+        try:
+            disposition = "WRITE_APPEND" if truncated else "WRITE_TRUNCATE"
+            job = load_file_to_bq(client, items[0]["table_id"], source, kind, disposition)
+            log.write(f"\n[↑] {items[0]['table_id']}: job enviado {job.job_id} ({len(items)} archivos)\n")
+            wait_for_job(job)
+            truncated = True
+            loaded += len(items)
+            log.write(f"    [✓] Cargado a BigQuery\n")
+        except Exception as e:
+            failed += len(items)
+            error_msg = str(e)[:200]
+            log.write(f"    [✗] ERROR: {error_msg}\n")
+        finally:
+            # Los intermedios _bqload locales ya no sirven, cargados o no:
+            # se liberan enseguida en vez de esperar al final de la corrida
+            remove_files(i["processed_path"] for i in items
+                         if i["work_dir"] and i["processed_path"].startswith(i["work_dir"] + os.sep))
+            # Igual con las copias reescritas en staging/: sin esto se acumulan
+            # en el bucket una corrida tras otra
+            remove_staging(i["processed_path"] for i in items if is_staging_uri(i["processed_path"]))
+
+    return loaded, skipped, failed, log.getvalue()
+
+
 def main():
     print("\n" + "="*75)
     print("  CARGA A BIGQUERY V2 - CON FILTRADO INTELIGENTE")
     print("="*75 + "\n")
 
-    client = bigquery.Client.from_service_account_json(config["gcp"]["credentials"])
+    client = _bq_client()
     ensure_dataset(client)
 
-    download_files_if_needed()
-    
-    all_files = sorted([
-        f for f in os.listdir(PROCESSED_DIR) 
-        if not f.startswith(".") and not f.endswith("_bqload.csv") and not f.endswith("_bqload.ndjson")
-    ])
+    if MODE == "cloud" and not (os.path.isdir(PROCESSED_DIR) and os.listdir(PROCESSED_DIR)):
+        # Sin copia local: se trabaja sobre los objetos de GCS sin bajarlos todos
+        sources = list_bucket_sources(_staging_bucket())
+    else:
+        download_files_if_needed()
+        # scandir: el tipo de cada entrada viene de la lectura del directorio
+        with os.scandir(PROCESSED_DIR) as it:
+            sources = [e for e in it if e.is_file()]
+
+    existing = {e.name for e in sources}
+    entries = sorted(
+        (e for e in sources
+         if not e.name.startswith(".")
+         and not e.name.endswith("_bqload.csv")
+         and not e.name.endswith("_bqload.ndjson")
+         and not e.name.endswith("_bqload.parquet")),
+        key=lambda e: e.name,
+    )
     
-    print(f"\n[i] {len(all_files)} archivos detectados\n")
+    print(f"\n[i] {len(entries)} archivos detectados\n")
 
     # Contadores
     loaded = 0
     skipped = 0
     failed = 0
 
-    for idx, filename in enumerate(all_files, 1):
-        path = os.path.join(PROCESSED_DIR, filename)
-
-        print(f"\n{'='*75}")
-        print(f"[{idx}/{len(all_files)}] {filename}")
-        print("="*75)
-
-        # ========== FILTRADO AUTOMÁTICO ==========
-        should_skip, skip_reason = should_skip_file(filename)
-        if should_skip:
-            skipped += 1
-            print(f"[⊘] OMITIDO: {skip_reason}\n")
-            continue
-
-        # Nombre de tabla
-        base = filename
-        base = re.sub(r"_\d{8,}", "", base)  # Eliminar timestamps
-        base = re.sub(r"_(clean|expanded|releases|cleancsv|cleanbin).*", "", base)
-        base = re.sub(r"\.\w+$", "", base)  # Eliminar extensión
-        table_name = clean_bq_column(base)
-        table_id = f"{PROJECT_ID}.{DATASET_ID}.{table_name}"
+    # Intermedios en directorios temporales de la corrida (tmpfs para los que
+    # caben, disco para el resto); se borran al terminar, haya o no errores
+    work_dir, shm_dir = make_work_dirs()
+    try:
+        # ========== ETAPA 0: PLAN DE TRABAJO ==========
+        plan = plan_files(entries, existing, work_dir, shm_dir=shm_dir)
+        n_planned = sum(item["status"] == "planned" for item in plan)
 
-        print(f"[→] Tabla destino: {table_name}")
+        # ========== ETAPAS 1+2: LIMPIEZA (CPU) SOLAPADA CON CARGA (I/O) ==========
+        # Los procesos limpian archivos mientras los hilos ya cargan los listos;
+        # un hilo por tabla: 1 TRUNCATE + N-1 APPEND en orden
+        # Limpieza en procesos (CPU, sin GIL): no más procesos que archivos;
+        # cada uno crea sus propios clientes GCP (ver _reset_clients)
+        cpu_workers = max(1, min(os.cpu_count() or 1, n_planned))
+        with ProcessPoolExecutor(max_workers=cpu_workers, initializer=_reset_clients) as procs, \
+             ThreadPoolExecutor(max_workers=BQ_LOAD_WORKERS) as threads:
 
-        try:
-            # ========== CSV ==========
-            if filename.endswith(".csv"):
-                valid, reason = validate_csv(path)
-                if not valid:
-                    print(f"[✗] CSV inválido: {reason}\n")
+            groups = {}
+            for idx, item in enumerate(plan, 1):
+                if item["status"] == "skipped":
                     skipped += 1
-                    continue
-                
-                processed_path = process_csv(path)
-                load_csv_to_bq(client, table_id, processed_path)
-                loaded += 1
-
-            # ========== NDJSON ==========
-            elif filename.endswith(".ndjson"):
-                processed_path = process_ndjson(path)
-                load_ndjson_to_bq(client, table_id, processed_path)
-                loaded += 1
+                    print(item_report(idx, len(plan), item), end="")
+                else:
+                    groups.setdefault(item["table_id"], []).append((idx, procs.submit(prepare_file, item)))
 
-            else:
-                print(f"[⊘] Formato no soportado\n")
-                skipped += 1
+            if groups:
+                print(f"\n[…] Limpiando y cargando {len(groups)} tablas con {BQ_LOAD_WORKERS} hilos...\n")
 
-        except Exception as e:
-            failed += 1
-            error_msg = str(e)[:200]
-            print(f"[✗] ERROR: {error_msg}\n")
+            futures = [threads.submit(load_table_group, client, pending, len(plan))
+                       for pending in groups.values()]
+            for future in as_completed(futures):
+                ok, omitted, errors, log = future.result()
+                loaded += ok
+                skipped += omitted
+                failed += errors
+                print(log, end="")
+    finally:
+        for path in (work_dir, shm_dir):
+            if path:
+                shutil.rmtree(path, ignore_errors=True)
 
     # ========== RESUMEN FINAL ==========
     print("\n" + "="*75)
@@ -1,34 +1,94 @@
 import os
+import io
+import codecs
+import itertools
 import json
-import hashlib
+import orjson
+import xxhash
 from datetime import datetime
 from urllib.parse import urlparse
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 from google.cloud import storage
+from google.cloud.storage import transfer_manager
+from google.auth.transport.requests import AuthorizedSession
+from google.oauth2 import service_account
+from requests.adapters import HTTPAdapter
 from src.config_loader import load_config
+from src.column_names import dedupe_columns
 import ast
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from functools import cache
 
 config = load_config()
 MODE = config.get("mode", "local")
 
 RAW_DIR = "data/raw"
 PROCESSED_DIR = "data/processed"
+SNIFF_BYTES = 8192  # muestra leída para detectar el encoding
+WRITE_BUFFER_BYTES = 1 << 20  # escrituras NDJSON agrupadas de ~1 MiB
+UPLOAD_WORKERS = 32  # subidas simultáneas a GCS
+DOWNLOAD_WORKERS = 32  # descargas simultáneas desde GCS
+LARGE_UPLOAD_BYTES = 64 * 1024 * 1024  # desde aquí se sube por partes
+UPLOAD_CHUNK_BYTES = 32 * 1024 * 1024
+UPLOAD_CHUNK_WORKERS = 8
+CSV_STREAM_BYTES = 64 * 1024 * 1024  # CSV más grandes se convierten por bloques
+CSV_BLOCK_BYTES = 16 * 1024 * 1024
+# claves no str y escalares NumPy (celdas de pandas) se serializan sin conversión previa
+ORJSON_OPTS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
 os.makedirs(RAW_DIR, exist_ok=True)
 os.makedirs(PROCESSED_DIR, exist_ok=True)
 
 
-def generate_unique_id(row):
-    raw = "|".join(map(str, row.values))
-    return hashlib.md5(raw.encode()).hexdigest()
+def generate_unique_ids(df):
+    """id_registro por fila: hash de 64 bits de todos sus valores, calculado
+    columna a columna en C (sin un md5 por fila desde Python)"""
+    try:
+        hashes = pd.util.hash_pandas_object(df, index=False)
+    except (TypeError, ValueError):
+        # celdas no hasheables (listas, dicts): se hashea su texto
+        hashes = pd.util.hash_pandas_object(df.astype(str), index=False)
+    return hashes.map("{:016x}".format)
+
+
+@cache
+def _storage_client():
+    """
+    Cliente de GCS único para la corrida (credenciales y sesión se crean una vez),
+    con un pool de conexiones del tamaño de los hilos de transferencia
+    """
+    credentials = service_account.Credentials.from_service_account_file(
+        config["gcp"]["credentials"], scopes=storage.Client.SCOPE
+    )
+    pool_size = max(UPLOAD_WORKERS, DOWNLOAD_WORKERS)
+    session = AuthorizedSession(credentials)
+    session.mount("https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+    return storage.Client(project=credentials.project_id, credentials=credentials, _http=session)
+
+
+@cache
+def _processed_bucket():
+    return _storage_client().bucket(config["gcp"]["bucket_processed"])
 
 
 def upload_to_bucket(local_path, dest_name):
-    bucket_name = config["gcp"]["bucket_processed"]
-    client = storage.Client.from_service_account_json(config["gcp"]["credentials"])
-    bucket = client.bucket(bucket_name)
+    bucket = _processed_bucket()
     blob = bucket.blob(dest_name)
-    blob.upload_from_filename(local_path)
-    print(f"[GCP] Subido a gs://{bucket_name}/{dest_name}")
+    if os.path.getsize(local_path) > LARGE_UPLOAD_BYTES:
+        # Archivos grandes: partes de 32 MiB subidas en paralelo (multipart XML API)
+        transfer_manager.upload_chunks_concurrently(
+            local_path,
+            blob,
+            chunk_size=UPLOAD_CHUNK_BYTES,
+            max_workers=UPLOAD_CHUNK_WORKERS,
+            worker_type=transfer_manager.THREAD,
+        )
+    else:
+        blob.upload_from_filename(local_path)
+    print(f"[GCP] Subido a gs://{bucket.name}/{dest_name}")
 
 
 # -----------------------
@@ -36,7 +96,8 @@ def upload_to_bucket(local_path, dest_name):
 # -----------------------
 def try_parse_json_like(text):
     """Intenta convertir a objeto JSON desde string que contenga JSON o lista.
-    Usa json.loads, y si falla intenta ast.literal_eval."""
+    Usa orjson, luego el repr de Python con comillas simples pasado a JSON
+    y json (NaN); solo si todo falla ast.literal_eval (mucho más lento)."""
     if text is None:
         return None
     if isinstance(text, (dict, list)):
@@ -46,6 +107,18 @@ def try_parse_json_like(text):
         return None
     # If already looks like JSON (starts with [ or {)
     if (s.startswith("{") and s.endswith("}")) or (s.startswith("[") and s.endswith("]")):
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            pass
+        # repr de Python ("['a', 'b']"): sin comillas dobles, cambiar ' por " es seguro;
+        # None/True/False o escapes \x hacen fallar orjson y se sigue con literal_eval
+        if '"' not in s:
+            try:
+                return orjson.loads(s.replace("'", '"'))
+            except orjson.JSONDecodeError:
+                pass
+        # json estándar acepta NaN/Infinity, que orjson rechaza
         try:
             return json.loads(s)
         except Exception:
@@ -58,6 +131,28 @@ def try_parse_json_like(text):
     return None
 
 
+def row_id(data: bytes) -> str:
+    """id_registro: xxh3 de 64 bits en hex (basta para deduplicar y es mucho más rápido que md5)"""
+    return xxhash.xxh3_64_hexdigest(data)
+
+
+def canonical_bytes(obj) -> bytes:
+    """JSON con claves ordenadas: mismo contenido, mismos bytes (entrada de row_id)"""
+    try:
+        return orjson.dumps(obj, option=ORJSON_OPTS | orjson.OPT_SORT_KEYS)
+    except orjson.JSONEncodeError:
+        return json.dumps(obj, sort_keys=True).encode()
+
+
+def to_json_str(value):
+    """Serializa un valor anidado a texto JSON (para guardarlo como columna string)"""
+    try:
+        return orjson.dumps(value, option=ORJSON_OPTS).decode()
+    except orjson.JSONEncodeError:
+        # enteros de más de 64 bits y tipos que orjson no conoce
+        return json.dumps(value, ensure_ascii=False)
+
+
 def ensure_list_of_same_length(l1, l2):
     if l1 is None or l2 is None:
         return False
@@ -67,17 +162,101 @@ def ensure_list_of_same_length(l1, l2):
 # -----------------------
 # Readers
 # -----------------------
+# espacios, guiones y barras de los encabezados → "_" en una sola pasada (tabla en C)
+_COLUMN_TRANS = str.maketrans({" ": "_", "-": "_", "/": "_"})
+
+
+def normalize_columns(columns):
+    """Encabezados en minúsculas y con "_"; los que coinciden tras normalizar
+    (p. ej. "a-b" y "a b") quedan como col, col_1 para que Parquet los acepte"""
+    return dedupe_columns([str(c).strip().lower().translate(_COLUMN_TRANS) for c in columns])
+
+
+def sniff_encoding(path):
+    """Encoding probable según los primeros bytes: BOM, UTF-8 válido o latin-1"""
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # un carácter multibyte cortado al final de la muestra no cuenta como error
+        if not (e.end == len(head) and e.reason == "unexpected end of data"):
+            return "latin-1"
+    return "utf-8"
+
+
+def _skip_row(row):
+    # igual que on_bad_lines="skip" de pandas: solo se descarta la fila con
+    # columnas de más; con una de menos la lectura falla y el siguiente intento
+    # (pandas) la conserva completando con nulos
+    return "skip" if row.actual_columns > row.expected_columns else "error"
+
+
+def arrow_csv_types(schema):
+    """
+    column_types que igualan los tipos de pyarrow a los del lector C de pandas:
+    fechas y horas quedan como texto y las columnas vacías como float64
+    """
+    types = {}
+    for field in schema:
+        if pa.types.is_temporal(field.type):
+            types[field.name] = pa.string()
+        elif pa.types.is_null(field.type):
+            types[field.name] = pa.float64()
+    return types
+
+
+def check_csv_text(schema):
+    """pyarrow no falla con bytes inválidos en el encoding: tipa la columna como binary"""
+    binary = [f.name for f in schema if pa.types.is_binary(f.type) or pa.types.is_large_binary(f.type)]
+    if binary:
+        raise pa.ArrowInvalid(f"Texto no válido en el encoding en columnas: {', '.join(binary[:5])}")
+
+
+def read_csv_arrow(path, encoding, skip_bad_lines=False):
+    """
+    CSV con el lector multihilo de pyarrow y los mismos tipos que el lector C
+    de pandas (ver arrow_csv_types). Lanza pa.ArrowInvalid si el archivo no
+    se puede leer o su texto no es válido en ese encoding
+    """
+    read_opts = pacsv.ReadOptions(block_size=CSV_BLOCK_BYTES, encoding=encoding)
+    parse_opts = pacsv.ParseOptions(invalid_row_handler=_skip_row if skip_bad_lines else None)
+    convert_opts = pacsv.ConvertOptions(strings_can_be_null=True)
+    table = pacsv.read_csv(path, read_options=read_opts, parse_options=parse_opts,
+                           convert_options=convert_opts)
+    check_csv_text(table.schema)
+    column_types = arrow_csv_types(table.schema)
+    if column_types:
+        # solo si hace falta: se vuelve a leer con esas columnas ya fijadas
+        convert_opts.column_types = column_types
+        table = pacsv.read_csv(path, read_options=read_opts, parse_options=parse_opts,
+                               convert_options=convert_opts)
+    return table.to_pandas()
+
+
 def read_csv_robusto(path):
     """Lectura tolerante de CSV: varios intentos de decodificación y fallbacks."""
-    # intentos por encoding y motores
+    # el encoding detectado va primero: normalmente el primer intento ya funciona
+    encoding = sniff_encoding(path)
+    # intentos por encoding y lector
     attempts = [
-        {"encoding": "utf-8", "engine": "c"},
-        {"encoding": "latin-1", "engine": "c"},
-        {"encoding": "latin-1", "engine": "python", "on_bad_lines": "skip"},
+        # pyarrow: tokenizador multihilo en C++, el más rápido
+        (read_csv_arrow, {"encoding": encoding}),
+        (pd.read_csv, {"encoding": encoding, "engine": "c"}),
+        (pd.read_csv, {"encoding": "latin-1", "engine": "c"}),
+        # filas con columnas de más: se descartan en el lector multihilo antes que en el de Python
+        (read_csv_arrow, {"encoding": encoding, "skip_bad_lines": True}),
+        (read_csv_arrow, {"encoding": "latin-1", "skip_bad_lines": True}),
+        (pd.read_csv, {"encoding": "latin-1", "engine": "python", "on_bad_lines": "skip"}),
     ]
-    for a in attempts:
+    attempts = [a for i, a in enumerate(attempts) if a not in attempts[:i]]
+    for reader, kwargs in attempts:
         try:
-            return pd.read_csv(path, **{k: v for k, v in a.items()})
+            return reader(path, **kwargs)
         except Exception:
             continue
 
@@ -95,12 +274,18 @@ def read_csv_robusto(path):
 def load_json_file(path):
     """Carga JSON desde archivo; devuelve objeto (list/dict) o None."""
     try:
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            text = f.read().strip()
-        if text == "":
+        # orjson parsea bytes directamente: sin decodificar a str antes
+        with open(path, "rb") as f:
+            data = f.read().removeprefix(codecs.BOM_UTF8).strip()
+        if not data:
             return None
         # A menudo file is NDJSON or array
-        # Try normal json loads
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+        text = data.decode("utf-8", errors="ignore")
+        # json estándar acepta NaN/Infinity, que orjson rechaza
         try:
             return json.loads(text)
         except Exception:
@@ -111,14 +296,17 @@ def load_json_file(path):
                 if not line:
                     continue
                 try:
-                    arr.append(json.loads(line))
-                except Exception:
-                    # fallback: attempt ast literal
+                    arr.append(orjson.loads(line))
+                except orjson.JSONDecodeError:
+                    # fallback: attempt json (NaN) and then ast literal
                     try:
-                        arr.append(ast.literal_eval(line))
+                        arr.append(json.loads(line))
                     except Exception:
-                        # skip invalid line
-                        continue
+                        try:
+                            arr.append(ast.literal_eval(line))
+                        except Exception:
+                            # skip invalid line
+                            continue
             if arr:
                 return arr
     except Exception:
@@ -141,17 +329,21 @@ def expand_clima(obj, fuente_archivo, fecha_proceso_utc, id_base):
 
     # If both lists and same length -> expand
     if ensure_list_of_same_length(time_list, temp_list):
+        # metadatos constantes: se leen una vez, no una por hora
+        latitude = obj.get("latitude")
+        longitude = obj.get("longitude")
+        elevation = obj.get("elevation")
         for t, temp in zip(time_list, temp_list):
             yield {
                 "fuente_archivo": fuente_archivo,
                 "fecha_proceso_utc": fecha_proceso_utc,
-                "id_registro": hashlib.md5(f"{id_base}|{t}|{temp}".encode()).hexdigest(),
+                "id_registro": row_id(f"{id_base}|{t}|{temp}".encode()),
                 "time": t,
                 "temperature_2m": temp,
                 # keep some top-level metadata
-                "latitude": obj.get("latitude"),
-                "longitude": obj.get("longitude"),
-                "elevation": obj.get("elevation")
+                "latitude": latitude,
+                "longitude": longitude,
+                "elevation": elevation
             }
         return
 
@@ -163,13 +355,13 @@ def expand_clima(obj, fuente_archivo, fecha_proceso_utc, id_base):
                 flattened[k] = v
             else:
                 try:
-                    flattened[k] = json.dumps(v, ensure_ascii=False)
+                    flattened[k] = to_json_str(v)
                 except Exception:
                     flattened[k] = str(v)
     flattened.update({
         "fuente_archivo": fuente_archivo,
         "fecha_proceso_utc": fecha_proceso_utc,
-        "id_registro": hashlib.md5((id_base + "_fallback").encode()).hexdigest()
+        "id_registro": row_id((id_base + "_fallback").encode())
     })
     yield flattened
 
@@ -190,12 +382,15 @@ def expand_usgs_feature(feature, fuente_archivo, fecha_proceso_utc):
         out["geometry.coordinates"] = coords
         out["type"] = feature.get("type")
         out["id"] = feature.get("id")
+        # id del evento + posición + hora lo identifican: no hace falta serializar todo el registro
+        id_src = f"{feature.get('id')}|{coords}|{props.get('time')}"
     else:
         # If feature is flatten like CSV row, just stringify
-        out["feature"] = json.dumps(feature, ensure_ascii=False)
+        out["feature"] = to_json_str(feature)
+        id_src = out["feature"]
     out["fuente_archivo"] = fuente_archivo
     out["fecha_proceso_utc"] = fecha_proceso_utc
-    out["id_registro"] = hashlib.md5(json.dumps(out, sort_keys=True).encode()).hexdigest()
+    out["id_registro"] = row_id(id_src.encode())
     return out
 
 
@@ -235,14 +430,14 @@ def expand_sercop_releases(obj, fuente_archivo, fecha_proceso_utc):
 
     for rel in releases:
         # build release-level record
-        release_id = rel.get("id") or rel.get("ocid") or hashlib.md5(json.dumps(rel, sort_keys=True).encode()).hexdigest()
+        release_id = rel.get("id") or rel.get("ocid") or row_id(canonical_bytes(rel))
         base = {
             "release_id": release_id,
             "fuente_archivo": fuente_archivo,
             "fecha_proceso_utc": fecha_proceso_utc,
-            "id_registro": hashlib.md5(f"{release_id}".encode()).hexdigest(),
+            "id_registro": row_id(f"{release_id}".encode()),
             # keep buyer short if exists
-            "buyer": json.dumps(rel.get("buyer", {}), ensure_ascii=False) if rel.get("buyer") else None,
+            "buyer": to_json_str(rel.get("buyer", {})) if rel.get("buyer") else None,
             "date": rel.get("date")
         }
         # yield release-level
@@ -251,19 +446,21 @@ def expand_sercop_releases(obj, fuente_archivo, fecha_proceso_utc):
         # expand awards -> items if present
         awards = rel.get("awards") or []
         for aw in awards:
-            award_id = aw.get("id") or hashlib.md5(json.dumps(aw, sort_keys=True).encode()).hexdigest()
+            award_id = aw.get("id") or row_id(canonical_bytes(aw))
             items = aw.get("items") or []
             for it in items:
+                # el item se serializa una sola vez: sirve para item_id (si falta) e id_registro
+                it_bytes = canonical_bytes(it)
                 item_record = {
                     "release_id": release_id,
                     "award_id": award_id,
-                    "item_id": it.get("id") or hashlib.md5(json.dumps(it, sort_keys=True).encode()).hexdigest(),
+                    "item_id": it.get("id") or row_id(it_bytes),
                     "description": it.get("description"),
                     "quantity": it.get("quantity"),
                     "unit_value": (it.get("unit", {}) or {}).get("value") if isinstance(it.get("unit"), dict) else None,
                     "fuente_archivo": fuente_archivo,
                     "fecha_proceso_utc": fecha_proceso_utc,
-                    "id_registro": hashlib.md5(json.dumps({"release": release_id, "item": it}, sort_keys=True).encode()).hexdigest()
+                    "id_registro": row_id(f"{release_id}|".encode() + it_bytes)
                 }
                 yield ("item", item_record, it)
 
@@ -271,25 +468,63 @@ def expand_sercop_releases(obj, fuente_archivo, fecha_proceso_utc):
 # -----------------------
 # Generic load_file
 # -----------------------
-def load_file_dynamic(path):
-    ext = path.split(".")[-1].lower()
-    if ext == "csv":
-        df = read_csv_robusto(path)
-        return ("csv", df)
-    if ext in ["xlsx", "xls"]:
-        df = pd.read_excel(path)
-        return ("csv", df)
-    # JSON-like
-    parsed = load_json_file(path)
-    if parsed is not None:
-        return ("json", parsed)
-    # bin or unknown - attempt to read as json then csv fallback
+def sniff_kind(path):
+    """Tipo probable según los primeros bytes: "json", "excel" o "csv" """
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    # xlsx es un zip; xls, un documento OLE
+    if head.startswith((b"PK\x03\x04", b"\xd0\xcf\x11\xe0")):
+        return "excel"
+    head = head.removeprefix(codecs.BOM_UTF8).lstrip()
+    if head[:1] in (b"{", b"["):
+        return "json"
+    return "csv"
+
+
+def read_csv_file(path):
+    if os.path.getsize(path) > CSV_STREAM_BYTES:
+        # no se carga: handle_csv_stream lo recorre bloque a bloque
+        return ("csv_stream", path)
+    return ("csv", read_csv_robusto(path))
+
+
+def read_excel_file(path):
     try:
+        # calamine (Rust): mucho más rápido que openpyxl/xlrd en Python puro
+        df = pd.read_excel(path, engine="calamine")
+    except (ImportError, ValueError):  # sin python-calamine o pandas < 2.2
+        df = pd.read_excel(path)
+    return ("csv", df)
+
+
+def read_sniffed_file(path):
+    # json, bin o desconocido: los primeros bytes deciden qué lector usar, así
+    # un CSV no pasa antes por el parseo JSON del archivo completo
+    kind = sniff_kind(path)
+    if kind == "json":
         parsed = load_json_file(path)
-        if parsed:
+        if parsed is not None:
             return ("json", parsed)
-        df = read_csv_robusto(path)
-        return ("csv", df)
+    if kind == "excel":
+        return read_excel_file(path)
+    return ("csv", read_csv_robusto(path))
+
+
+# Lector según extensión; cada uno retorna (tipo, contenido) para handler_for
+READERS = {
+    "csv": read_csv_file,
+    "xlsx": read_excel_file,
+    "xls": read_excel_file,
+}
+
+
+def load_file_dynamic(path):
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    reader = READERS.get(ext)
+    if reader is not None:
+        return reader(path)
+    try:
+        return read_sniffed_file(path)
     except Exception:
         return (None, None)
 
@@ -297,165 +532,344 @@ def load_file_dynamic(path):
 # -----------------------
 # Main pipeline
 # -----------------------
+def ndjson_line(obj) -> bytes:
+    """Un registro serializado como línea NDJSON (bytes UTF-8)"""
+    try:
+        return orjson.dumps(obj, option=ORJSON_OPTS | orjson.OPT_APPEND_NEWLINE)
+    except orjson.JSONEncodeError:
+        return (json.dumps(obj, ensure_ascii=False) + "\n").encode()
+
+
 def write_ndjson_lines(out_path, iterable):
-    with open(out_path, "w", encoding="utf-8") as fout:
-        count = 0
+    """Escribe un registro por línea con orjson (bytes UTF-8), en bloques de ~1 MiB
+    iterable puede ser un generador: los registros no se acumulan en memoria"""
+    count = 0
+    buf = bytearray()
+    with open(out_path, "wb") as fout:
         for obj in iterable:
-            fout.write(json.dumps(obj, ensure_ascii=False) + "\n")
+            buf += ndjson_line(obj)
             count += 1
+            if len(buf) >= WRITE_BUFFER_BYTES:
+                fout.write(buf)
+                buf.clear()
+        fout.write(buf)
     return count
 
 
-def main():
-    print("\n========== INICIANDO TRANSFORMACIÓN ==========\n")
-    print(f"Modo: {MODE}")
-    # ensure directories
-    os.makedirs(RAW_DIR, exist_ok=True)
-    os.makedirs(PROCESSED_DIR, exist_ok=True)
+def write_ndjson_split(paths, tagged):
+    """Como write_ndjson_lines, pero reparte tuplas (tipo, registro, ...) entre
+    varios archivos en una sola pasada; paths: {tipo: ruta}
+    Un archivo solo se crea si recibe al menos un registro
+    Retorna: {tipo: filas escritas}"""
+    counts = dict.fromkeys(paths, 0)
+    files = {}
+    bufs = {}
+    try:
+        for typ, payload, *_ in tagged:
+            if typ not in paths:
+                continue
+            if typ not in files:
+                files[typ] = open(paths[typ], "wb")
+                bufs[typ] = bytearray()
+            buf = bufs[typ]
+            buf += ndjson_line(payload)
+            counts[typ] += 1
+            if len(buf) >= WRITE_BUFFER_BYTES:
+                files[typ].write(buf)
+                buf.clear()
+    finally:
+        for typ, fout in files.items():
+            fout.write(bufs[typ])
+            fout.close()
+    return counts
+
+
+def flatten_json_records(content, fuente_archivo, fecha_proceso_utc):
+    """JSON genérico: un registro plano por objeto (valores anidados como texto JSON)"""
+    objs = content if isinstance(content, list) else [content] if isinstance(content, dict) else []
+    for obj in objs:
+        # flatten simple objects minimally
+        rec = {}
+        for k, v in (obj.items() if isinstance(obj, dict) else []):
+            if isinstance(v, (str, int, float, bool)):
+                rec[k] = v
+            else:
+                rec[k] = to_json_str(v)
+        rec["fuente_archivo"] = fuente_archivo
+        rec["fecha_proceso_utc"] = fecha_proceso_utc
+        rec["id_registro"] = row_id(canonical_bytes(rec))
+        yield rec
 
-    # If mode cloud, download files from bucket_raw
-    if MODE == "cloud":
-        client = storage.Client.from_service_account_json(config["gcp"]["credentials"])
-        bucket = client.bucket(config["gcp"]["bucket_raw"])
-        for blob in bucket.list_blobs():
-            dest = os.path.join(RAW_DIR, blob.name)
-            os.makedirs(os.path.dirname(dest), exist_ok=True)
-            blob.download_to_filename(dest)
-            print(f"[GCP] Descargado → {dest}")
-
-    files = sorted(os.listdir(RAW_DIR))
-    print("[INFO] Archivos en raw:", files)
 
-    for filename in files:
+# -----------------------
+# Handlers: un tratamiento por tipo de dataset
+# Cada uno escribe sus salidas en PROCESSED_DIR y retorna sus rutas
+# -----------------------
+def handle_clima(content, filename, fecha_proceso_utc, base_name):
+    # content is dict or list; los registros se generan a medida que se escriben
+    if isinstance(content, list):
+        # if NDJSON array of objects, iterate
+        records = itertools.chain.from_iterable(
+            expand_clima(obj, filename, fecha_proceso_utc, base_name) for obj in content
+        )
+    elif isinstance(content, dict):
+        records = expand_clima(content, filename, fecha_proceso_utc, base_name)
+    else:
+        records = []
+    out_path = os.path.join(PROCESSED_DIR, f"{base_name}_expanded.ndjson")
+    n = write_ndjson_lines(out_path, records)
+    print(f"[OK] Clima expandido -> {out_path} ({n} filas)")
+    return [out_path]
+
+
+def handle_sismos(content, filename, fecha_proceso_utc, base_name):
+    # sismos: content is probably dict with features list
+    out_path = os.path.join(PROCESSED_DIR, f"{base_name}_expanded.ndjson")
+    n = write_ndjson_lines(out_path, expand_sismos_list(content, filename, fecha_proceso_utc))
+    print(f"[OK] Sismos expandido -> {out_path} ({n} filas)")
+    return [out_path]
+
+
+def handle_sercop(content, filename, fecha_proceso_utc, base_name):
+    # SERCOP releases: releases e items se escriben en una sola pasada, cada uno a su archivo
+    paths = {
+        "release": os.path.join(PROCESSED_DIR, f"{base_name}_releases_expanded.ndjson"),
+        "item": os.path.join(PROCESSED_DIR, f"{base_name}_items_expanded.ndjson"),
+    }
+    counts = write_ndjson_split(paths, expand_sercop_releases(content, filename, fecha_proceso_utc))
+    written = []
+    for typ, label in (("release", "Releases"), ("item", "Items")):
+        if counts[typ]:
+            print(f"[OK] {label} -> {paths[typ]} ({counts[typ]} filas)")
+            written.append(paths[typ])
+    return written
+
+
+def handle_csv(content, filename, fecha_proceso_utc, base_name):
+    # Save standardized CSV clean (if pandas DataFrame)
+    df = content
+    if not isinstance(df, pd.DataFrame):
+        print(f"[WARN] CSV leído pero no DataFrame: {filename}")
+        return []
+    # normalize columns
+    df.columns = normalize_columns(df.columns)
+    df["fuente_archivo"] = filename
+    df["fecha_proceso_utc"] = fecha_proceso_utc
+    df["id_registro"] = generate_unique_ids(df)
+    # Parquet (zstd): tipado y comprimido, BigQuery lo carga sin autodetect
+    out_path = os.path.join(PROCESSED_DIR, f"{base_name}_cleancsv.parquet")
+    try:
+        df.to_parquet(out_path, engine="pyarrow", compression="zstd", index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        # columnas con tipos mezclados: se mantiene la salida CSV
+        print(f"[WARN] Parquet no posible ({str(e)[:80]}), se escribe CSV")
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        out_path = os.path.join(PROCESSED_DIR, f"{base_name}_cleancsv.csv")
+        df.to_csv(out_path, index=False, encoding="utf-8")
+    print(f"[OK] CSV procesado -> {out_path}")
+    return [out_path]
+
+
+def stream_csv_types(path, read_opts, convert_opts):
+    """
+    Primera pasada bloque a bloque (sin escribir nada): fija los column_types
+    con los que la conversión por bloques da los mismos tipos que handle_csv
+    sobre la lectura completa. Fechas como texto, columnas vacías como float64
+    (arrow_csv_types) y enteros con algún nulo como float64, igual que pandas
+    Lanza pa.ArrowInvalid si un bloque no encaja con los tipos del primero
+    """
+    reader = pacsv.open_csv(path, read_options=read_opts, convert_options=convert_opts)
+    try:
+        check_csv_text(reader.schema)
+        column_types = arrow_csv_types(reader.schema)
+    finally:
+        reader.close()
+    convert_opts.column_types = column_types
+
+    reader = pacsv.open_csv(path, read_options=read_opts, convert_options=convert_opts)
+    try:
+        ints = [i for i, f in enumerate(reader.schema) if pa.types.is_integer(f.type)]
+        for batch in reader:
+            for i in [i for i in ints if batch.column(i).null_count]:
+                column_types[reader.schema.field(i).name] = pa.float64()
+                ints.remove(i)
+    finally:
+        reader.close()
+    return column_types
+
+
+def csv_to_parquet_stream(path, filename, fecha_proceso_utc, out_path):
+    """
+    CSV → Parquet bloque a bloque: en memoria solo hay un bloque a la vez
+    Dos pasadas: stream_csv_types fija los tipos y la segunda escribe. Lanza
+    pa.ArrowInvalid si el archivo no se puede convertir así (tipos que cambian
+    a mitad de archivo, filas mal formadas). Retorna el número de filas escritas
+    """
+    read_opts = pacsv.ReadOptions(block_size=CSV_BLOCK_BYTES, encoding=sniff_encoding(path))
+    convert_opts = pacsv.ConvertOptions(strings_can_be_null=True)
+    convert_opts.column_types = stream_csv_types(path, read_opts, convert_opts)
+    reader = pacsv.open_csv(path, read_options=read_opts, convert_options=convert_opts)
+    names = normalize_columns(reader.schema.names)
+
+    rows = 0
+    writer = None
+    try:
+        for batch in reader:
+            n = batch.num_rows
+            if not n:
+                continue
+            df = batch.to_pandas()  # solo para calcular los ids del bloque
+            df.columns = names
+            df["fuente_archivo"] = filename
+            df["fecha_proceso_utc"] = fecha_proceso_utc
+            table = pa.Table.from_batches([batch]).rename_columns(names)
+            table = table.append_column("fuente_archivo", pa.repeat(pa.scalar(filename), n))
+            table = table.append_column("fecha_proceso_utc", pa.repeat(pa.scalar(fecha_proceso_utc), n))
+            table = table.append_column("id_registro", pa.array(generate_unique_ids(df).tolist(), pa.string()))
+            if writer is None:
+                writer = pq.ParquetWriter(out_path, table.schema, compression="zstd")
+            writer.write_table(table)
+            rows += n
+    finally:
+        reader.close()
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def handle_csv_stream(content, filename, fecha_proceso_utc, base_name):
+    # content es la ruta: el CSV es grande y no se cargó completo
+    out_path = os.path.join(PROCESSED_DIR, f"{base_name}_cleancsv.parquet")
+    try:
+        rows = csv_to_parquet_stream(content, filename, fecha_proceso_utc, out_path)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, UnicodeDecodeError) as e:
+        # tipos que cambian a mitad de archivo o filas mal formadas: lectura completa
+        print(f"[WARN] Conversión por bloques no posible ({str(e)[:80]}), se lee completo")
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        return handle_csv(read_csv_robusto(content), filename, fecha_proceso_utc, base_name)
+    if not rows:  # solo encabezado: sin bloques no hay esquema que escribir
+        return handle_csv(read_csv_robusto(content), filename, fecha_proceso_utc, base_name)
+    print(f"[OK] CSV procesado por bloques -> {out_path} ({rows} filas)")
+    return [out_path]
+
+
+def handle_json(content, filename, fecha_proceso_utc, base_name):
+    # If it's JSON but not one of the special cases above, create NDJSON line per record
+    out_path = os.path.join(PROCESSED_DIR, f"{base_name}_clean_expanded.ndjson")
+    n = write_ndjson_lines(out_path, flatten_json_records(content, filename, fecha_proceso_utc))
+    if not n:
+        os.remove(out_path)
+        print(f"[WARN] No se generaron registros para {filename}")
+        return []
+    print(f"[OK] JSON general -> {out_path} ({n} filas)")
+    return [out_path]
+
+
+# Tratamiento según prefijo del nombre de archivo (opción A: tabla por archivo);
+# si ninguno coincide, según el tipo leído
+DISPATCH = {
+    "api_clima": handle_clima,
+    "api_sismos_usgs": handle_sismos,
+    "api_sismos_ec": handle_sismos,
+    "releases": handle_sercop,
+}
+HANDLERS_BY_TYPE = {
+    "csv": handle_csv,
+    "csv_stream": handle_csv_stream,
+    "json": handle_json,
+}
+
+
+def handler_for(filename, ftype):
+    for prefix, handler in DISPATCH.items():
+        if filename.startswith(prefix):
+            return handler
+    return HANDLERS_BY_TYPE.get(ftype)
+
+
+def process_one(filename, fecha_proceso_utc):
+    """
+    Transforma un archivo de raw/ a processed/ (se ejecuta en un proceso aparte)
+    fecha_proceso_utc es la misma para todos los archivos de la corrida
+    La salida se captura para imprimirla de una vez desde el proceso principal
+    Retorna: (log, [(ruta_local, destino_en_bucket)]) con lo que hay que subir
+    """
+    log = io.StringIO()
+    outputs = []
+
+    with redirect_stdout(log):
         raw_path = os.path.join(RAW_DIR, filename)
         print(f"\n[INFO] Procesando: {filename}")
 
         ftype, content = load_file_dynamic(raw_path)
         if ftype is None or content is None:
             print(f"[SKIP] No se pudo leer: {filename}")
-            continue
+            return log.getvalue(), outputs
+
+        handler = handler_for(filename, ftype)
+        if handler is None:
+            print(f"[SKIP] No se reconoce el patrón de nombre ni el tipo: {filename}")
+            return log.getvalue(), outputs
 
-        fecha_proceso_utc = datetime.utcnow().isoformat()
         base_name = filename.rsplit(".", 1)[0]
+        written = handler(content, filename, fecha_proceso_utc, base_name)
 
-        # Decide ruta y tratamiento según nombre de archivo (opción A: tabla por archivo)
-        if filename.startswith("api_clima"):
-            # content is dict or list
-            if isinstance(content, list):
-                # if NDJSON array of objects, take first or iterate
-                iterable = []
-                for obj in content:
-                    for rec in expand_clima(obj, filename, fecha_proceso_utc, base_name):
-                        iterable.append(rec)
-            elif isinstance(content, dict):
-                iterable = list(expand_clima(content, filename, fecha_proceso_utc, base_name))
-            else:
-                iterable = []
-            out_filename = f"{base_name}_expanded.ndjson"
-            out_path = os.path.join(PROCESSED_DIR, out_filename)
-            n = write_ndjson_lines(out_path, iterable)
-            print(f"[OK] Clima expandido -> {out_path} ({n} filas)")
-            if MODE == "cloud":
-                upload_to_bucket(out_path, f"processed/{out_filename}")
-
-        elif filename.startswith("api_sismos_usgs") or filename.startswith("api_sismos_ec"):
-            # sismos: content is probably dict with features list
-            iterable = []
-            for rec in expand_sismos_list(content, filename, fecha_proceso_utc):
-                iterable.append(rec)
-            out_filename = f"{base_name}_expanded.ndjson"
-            out_path = os.path.join(PROCESSED_DIR, out_filename)
-            n = write_ndjson_lines(out_path, iterable)
-            print(f"[OK] Sismos expandido -> {out_path} ({n} filas)")
-            if MODE == "cloud":
-                upload_to_bucket(out_path, f"processed/{out_filename}")
-
-        elif filename.startswith("releases"):
-            # SERCOP releases: expand releases and items
-            iterable_releases = []
-            iterable_items = []
-            for t in expand_sercop_releases(content, filename, fecha_proceso_utc):
-                typ, payload, rawrel = t
-                if typ == "release":
-                    iterable_releases.append(payload)
-                elif typ == "item":
-                    iterable_items.append(payload)
-            if iterable_releases:
-                out_rel = os.path.join(PROCESSED_DIR, f"{base_name}_releases_expanded.ndjson")
-                write_ndjson_lines(out_rel, iterable_releases)
-                print(f"[OK] Releases -> {out_rel} ({len(iterable_releases)} filas)")
-                if MODE == "cloud":
-                    upload_to_bucket(out_rel, f"processed/{os.path.basename(out_rel)}")
-            if iterable_items:
-                out_items = os.path.join(PROCESSED_DIR, f"{base_name}_items_expanded.ndjson")
-                write_ndjson_lines(out_items, iterable_items)
-                print(f"[OK] Items -> {out_items} ({len(iterable_items)} filas)")
-                if MODE == "cloud":
-                    upload_to_bucket(out_items, f"processed/{os.path.basename(out_items)}")
-
-        elif ftype == "csv":
-            # Save standardized CSV clean (if pandas DataFrame)
-            df = content
-            if isinstance(df, pd.DataFrame):
-                # normalize columns
-                df.columns = (
-                    df.columns.str.strip()
-                              .str.lower()
-                              .str.replace(" ", "_")
-                              .str.replace("-", "_")
-                              .str.replace("/", "_")
-                )
-                df["fuente_archivo"] = filename
-                df["fecha_proceso_utc"] = fecha_proceso_utc
-                df["id_registro"] = df.apply(lambda r: generate_unique_id(r), axis=1)
-                out_filename = f"{base_name}_cleancsv.csv"
-                out_path = os.path.join(PROCESSED_DIR, out_filename)
-                df.to_csv(out_path, index=False, encoding="utf-8")
-                print(f"[OK] CSV procesado -> {out_path}")
-                if MODE == "cloud":
-                    upload_to_bucket(out_path, f"processed/{out_filename}")
-            else:
-                print(f"[WARN] CSV leído pero no DataFrame: {filename}")
-
-        elif ftype == "json":
-            # If it's JSON but not one of the special cases above, create NDJSON line per record
-            iterable = []
-            if isinstance(content, list):
-                for obj in content:
-                    # flatten simple objects minimally
-                    rec = {}
-                    for k, v in (obj.items() if isinstance(obj, dict) else []):
-                        if isinstance(v, (str, int, float, bool)):
-                            rec[k] = v
-                        else:
-                            rec[k] = json.dumps(v, ensure_ascii=False)
-                    rec["fuente_archivo"] = filename
-                    rec["fecha_proceso_utc"] = fecha_proceso_utc
-                    rec["id_registro"] = hashlib.md5(json.dumps(rec, sort_keys=True).encode()).hexdigest()
-                    iterable.append(rec)
-            elif isinstance(content, dict):
-                rec = {}
-                for k, v in content.items():
-                    if isinstance(v, (str, int, float, bool)):
-                        rec[k] = v
-                    else:
-                        rec[k] = json.dumps(v, ensure_ascii=False)
-                rec["fuente_archivo"] = filename
-                rec["fecha_proceso_utc"] = fecha_proceso_utc
-                rec["id_registro"] = hashlib.md5(json.dumps(rec, sort_keys=True).encode()).hexdigest()
-                iterable.append(rec)
-            if iterable:
-                out_filename = f"{base_name}_clean_expanded.ndjson"
-                out_path = os.path.join(PROCESSED_DIR, out_filename)
-                write_ndjson_lines(out_path, iterable)
-                print(f"[OK] JSON general -> {out_path} ({len(iterable)} filas)")
-                if MODE == "cloud":
-                    upload_to_bucket(out_path, f"processed/{out_filename}")
-            else:
-                print(f"[WARN] No se generaron registros para {filename}")
+        if MODE == "cloud":  # se sube desde el proceso principal
+            outputs = [(path, f"processed/{os.path.basename(path)}") for path in written]
 
-        else:
-            print(f"[SKIP] No se reconoce el patrón de nombre ni el tipo: {filename}")
+    return log.getvalue(), outputs
+
+
+def main():
+    print("\n========== INICIANDO TRANSFORMACIÓN ==========\n")
+    print(f"Modo: {MODE}")
+    # RAW_DIR y PROCESSED_DIR ya se crean al importar el módulo
+
+    # If mode cloud, download files from bucket_raw
+    if MODE == "cloud":
+        bucket = _storage_client().bucket(config["gcp"]["bucket_raw"])
+        blob_names = [b.name for b in bucket.list_blobs() if not b.name.endswith("/")]
+        # Descargas en paralelo; las subcarpetas se crean una vez cada una
+        results = transfer_manager.download_many_to_path(
+            bucket,
+            blob_names,
+            destination_directory=RAW_DIR,
+            create_directories=True,
+            max_workers=DOWNLOAD_WORKERS,
+            worker_type=transfer_manager.THREAD,
+        )
+        # Solo se detallan los errores; los éxitos se resumen en una línea
+        errors = [(name, r) for name, r in zip(blob_names, results) if isinstance(r, Exception)]
+        for name, error in errors:
+            print(f"[ERROR] No se pudo descargar {name}: {str(error)[:100]}")
+        print(f"[GCP] Descargados {len(blob_names) - len(errors)}/{len(blob_names)} archivos → {RAW_DIR}")
+
+    # scandir: tipo y tamaño salen de la lectura del directorio; los más grandes
+    # van primero para que el más lento no quede solo al final de la corrida
+    with os.scandir(RAW_DIR) as it:
+        entries = [e for e in it if e.is_file()]
+    entries.sort(key=lambda e: e.stat().st_size, reverse=True)
+    files = [e.name for e in entries]
+    print("[INFO] Archivos en raw:", files)
+
+    # Cada archivo es independiente: se transforman en paralelo (CPU, sin GIL)
+    # y sus salidas se suben en hilos (red) apenas cada uno termina, mientras
+    # los procesos siguen con los demás archivos
+    workers = max(1, min(os.cpu_count() or 1, len(files)))
+    fecha_proceso_utc = datetime.utcnow().isoformat()  # una marca por corrida
+    uploads = []
+    with ProcessPoolExecutor(max_workers=workers) as procs, \
+         ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as threads:
+        futures = [procs.submit(process_one, filename, fecha_proceso_utc) for filename in files]
+        for future in as_completed(futures):
+            log, outputs = future.result()
+            print(log, end="")
+            for local_path, dest_name in outputs:
+                uploads.append(threads.submit(upload_to_bucket, local_path, dest_name))
+        for future in uploads:
+            future.result()  # propaga el primer error de subida
 
     print("\n========== TRANSFORMACIÓN COMPLETA ==========\n")
 
@@ -1,8 +1,11 @@
 import os
-import pandas as pd
-from google.cloud import bigquery
-from google.oauth2 import service_account
+import shutil
+from concurrent.futures import ProcessPoolExecutor
 from src.config_loader import load_config
+from src.load.load_to_bigquery import (
+    SOURCE_KINDS, _bq_client, _reset_clients, item_report, load_table_group,
+    make_work_dirs, plan_files, prepare_file, table_name_for,
+)
 
 # ======================================================
 # CARGA DE CONFIG
@@ -11,60 +14,72 @@ config = load_config()
 MODE = config["mode"]
 
 PROCESSED_DIR = "data/processed"
+# lo que escribe transform (Parquet, NDJSON, CSV de respaldo) más los .json,
+# que en este directorio son JSON por líneas
+SOURCE_KINDS_ANALYTICS = {**SOURCE_KINDS, ".json": "ndjson"}
 
 PROJECT_ID = config["gcp"]["project_id"]
 DATASET_ID = config["gcp"]["dataset_analytics"]
-CREDENTIALS_PATH = config["gcp"]["credentials"]
 
 
 # ======================================================
 # CREAR CLIENTE BIGQUERY
 # ======================================================
 def get_bq_client():
-    creds = service_account.Credentials.from_service_account_file(CREDENTIALS_PATH)
-    return bigquery.Client(credentials=creds, project=PROJECT_ID)
+    # Mismo cliente (con credenciales) que usa src/load/load_to_bigquery.py
+    return _bq_client()
 
 
 # ======================================================
 # NORMALIZAR NOMBRE DE TABLA
 # ======================================================
 def normalize_table_name(filename):
-    name = filename.lower()
-    name = name.replace(".csv", "").replace(".json", "")
-    name = name.replace(".", "_")
-    name = name.replace("-", "_")
-    return name
+    # Misma regla que src/load/load_to_bigquery.py: un archivo termina en la
+    # misma tabla sin importar qué loader lo suba
+    return table_name_for(filename)
 
 
 # ======================================================
-# SUBIR ARCHIVO A BIGQUERY
+# SUBIR ARCHIVOS A BIGQUERY
 # ======================================================
-def load_to_bigquery(filepath, table_name):
-    client = get_bq_client()
-    table_id = f"{PROJECT_ID}.{DATASET_ID}.{table_name}"
-
-    print(f"[INFO] Cargando a BigQuery: {table_id}")
-
-    # autodetección de esquema
-    job_config = bigquery.LoadJobConfig(
-        autodetect=True,
-        source_format=(
-            bigquery.SourceFormat.CSV if filepath.endswith(".csv")
-            else bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
-        ),
-        write_disposition="WRITE_TRUNCATE",  # siempre reemplaza tabla (ideal para pipeline)
-    )
-
-    with open(filepath, "rb") as f:
-        load_job = client.load_table_from_file(
-            f, table_id, job_config=job_config
-        )
-
-    load_job.result()  # Esperar a que termine
-
-    print(f"[OK] Tabla creada/cargada: {table_id}")
-    table = client.get_table(table_id)
-    print(f"[OK] Filas cargadas: {table.num_rows}")
+def load_processed(client, entries):
+    """
+    Carga los archivos con el mismo flujo que src/load/load_to_bigquery.py:
+    prepare_file limpia nombres y aplana lo que BigQuery rechazaría, y
+    load_table_group carga cada tabla (TRUNCATE + APPEND) y reporta los
+    errores por archivo sin detener la corrida
+    Retorna: (cargados, omitidos, fallidos)
+    """
+    loaded = skipped = failed = 0
+    existing = {e.name for e in entries}
+    entries = sorted(entries, key=lambda e: e.name)
+
+    work_dir, shm_dir = make_work_dirs()
+    try:
+        plan = plan_files(entries, existing, work_dir, DATASET_ID, SOURCE_KINDS_ANALYTICS, shm_dir)
+        n_planned = sum(item["status"] == "planned" for item in plan)
+        workers = max(1, min(os.cpu_count() or 1, n_planned))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_reset_clients) as procs:
+            groups = {}
+            for idx, item in enumerate(plan, 1):
+                if item["status"] == "skipped":
+                    skipped += 1
+                    print(item_report(idx, len(plan), item), end="")
+                else:
+                    groups.setdefault(item["table_id"], []).append((idx, procs.submit(prepare_file, item)))
+
+            for pending in groups.values():
+                ok, omitted, errors, log = load_table_group(client, pending, len(plan))
+                loaded += ok
+                skipped += omitted
+                failed += errors
+                print(log, end="")
+    finally:
+        for path in (work_dir, shm_dir):
+            if path:
+                shutil.rmtree(path, ignore_errors=True)
+
+    return loaded, skipped, failed
 
 
 # ======================================================
@@ -77,27 +92,19 @@ def main():
         print("[ERROR] No existe data/processed. Ejecuta TRANSFORM primero.")
         exit(1)
 
-    files = os.listdir(PROCESSED_DIR)
+    # scandir: nombre, ruta y tipo salen de la misma lectura del directorio
+    with os.scandir(PROCESSED_DIR) as it:
+        entries = [e for e in it if e.is_file()]
 
-    if not files:
+    if not entries:
         print("[WARN] No hay archivos procesados para cargar.")
         return
 
     print(f"[INFO] Archivos detectados en {PROCESSED_DIR}:")
-    print(files)
-
-    for filename in files:
-        filepath = os.path.join(PROCESSED_DIR, filename)
-
-        if not os.path.isfile(filepath):
-            continue
-
-        if not (filename.endswith(".csv") or filename.endswith(".json")):
-            print(f"[SKIP] Formato no soportado para BigQuery: {filename}")
-            continue
+    print([e.name for e in entries])
 
-        table_name = normalize_table_name(filename)
-        load_to_bigquery(filepath, table_name)
+    loaded, skipped, failed = load_processed(get_bq_client(), entries)
+    print(f"\n[INFO] Cargados: {loaded} | Omitidos: {skipped} | Fallidos: {failed}")
 
     print("\n========== CARGA A BIGQUERY COMPLETA ==========\n")
 
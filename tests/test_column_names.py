@@ -0,0 +1,20 @@
+from src.column_names import clean_bq_column, dedupe_columns
+
+
+def test_dedupe_columns_numera_repetidos():
+    assert dedupe_columns(["a", "b", "a", "a"]) == ["a", "b", "a_1", "a_2"]
+
+
+def test_dedupe_columns_no_choca_con_nombres_existentes():
+    # "a_1" ya existe: el segundo "a" no puede tomar ese nombre
+    assert dedupe_columns(["a", "a", "a_1"]) == ["a", "a_1", "a_1_1"]
+    assert dedupe_columns(["a", "a_1", "a"]) == ["a", "a_1", "a_2"]
+    columns = dedupe_columns(["a", "a", "a_1", "a_1", "a"])
+    assert len(columns) == len(set(columns))
+
+
+def test_clean_bq_column():
+    assert clean_bq_column("﻿Monto (USD)") == "monto_usd"
+    assert clean_bq_column("properties.mag") == "properties_mag"
+    assert clean_bq_column("2024") == "col_2024"
+    assert clean_bq_column("()") == "unnamed"
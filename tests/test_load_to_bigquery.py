@@ -0,0 +1,47 @@
+import pytest
+
+pytest.importorskip("google.cloud.bigquery")
+pytest.importorskip("google.cloud.storage")
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from src.load.load_to_bigquery import process_csv, rewrite_csv
+
+
+def test_process_csv_conserva_filas_cortas_como_pandas(tmp_path):
+    # fila corta (se conserva con nulos) y fila larga (se descarta), como en pandas
+    src = tmp_path / "datos.csv"
+    src.write_text("a,b,c\n1,2,3\n4,5\n6,7,8,9\n10,11,12\n")
+
+    destination, kind = process_csv(str(src), ",", None, str(tmp_path))
+
+    expected = pd.read_csv(src, on_bad_lines="skip")
+    assert kind == "parquet"
+    table = pq.read_table(destination)
+    assert table.num_rows == len(expected) == 3
+    assert table.column("c").to_pylist() == [3, None, 12]
+
+
+def test_process_csv_descarta_solo_filas_largas(tmp_path):
+    src = tmp_path / "datos.csv"
+    src.write_text("a,b\n1,2\n3,4,5\n6,7\n")
+
+    destination, kind = process_csv(str(src), ",", None, str(tmp_path))
+
+    assert kind == "parquet"
+    assert pq.read_table(destination).num_rows == len(pd.read_csv(src, on_bad_lines="skip")) == 2
+
+
+def test_rewrite_csv_completa_filas_cortas(tmp_path):
+    src = tmp_path / "datos.csv"
+    src.write_text("a;b;c\n1;2;3\n4;5\n6;7;8;9\n10;11;12\n")
+
+    destination = rewrite_csv(str(src), ";", None, str(tmp_path))
+
+    expected = pd.read_csv(src, sep=";", on_bad_lines="skip")
+    rows = [line.split(",") for line in open(destination).read().splitlines()]
+    assert rows[0] == ["a", "b", "c"]
+    assert len(rows) - 1 == len(expected) == 3
+    assert all(len(row) == 3 for row in rows)
+    assert rows[2] == ["4", "5", ""]
@@ -0,0 +1,20 @@
+import pytest
+
+pytest.importorskip("google.cloud.storage")
+
+import pandas as pd
+
+from src.transform.transform import read_csv_robusto
+
+
+def test_read_csv_robusto_conserva_filas_cortas(tmp_path):
+    # fila larga (se descarta) y fila corta (se conserva con nulos)
+    src = tmp_path / "datos.csv"
+    src.write_text("a,b,c\n1,2,3\n4,5,6,7\n8,9\n10,11,12\n")
+
+    df = read_csv_robusto(str(src))
+
+    expected = pd.read_csv(src, engine="python", on_bad_lines="skip")
+    assert len(df) == len(expected) == 3
+    assert df["a"].tolist() == [1, 8, 10]
+    assert pd.isna(df["c"].iloc[1])